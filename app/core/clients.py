@@ -0,0 +1,155 @@
+import httpx
+import logging
+from contextlib import asynccontextmanager
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import LockError, RedisError
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class ClientManager:
+    """Process-wide pooled clients for Redis and Ollama.
+
+    Opened once in the FastAPI lifespan and shared by every service, so a chat
+    turn reuses pooled connections instead of opening new ones per call.
+    """
+
+    def __init__(self):
+        self._redis_pool = None
+        self._redis = None
+        self._redis_bytes_pool = None
+        self._redis_bytes = None
+        self._http = None
+
+    def _create_redis(self):
+        self._redis_pool = BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+        self._redis = Redis(connection_pool=self._redis_pool)
+
+    def _create_redis_bytes(self):
+        self._redis_bytes_pool = BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+        self._redis_bytes = Redis(connection_pool=self._redis_bytes_pool)
+
+    def _create_http(self):
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            # Reads stay unbounded: Ollama may need minutes to load a model.
+            timeout=httpx.Timeout(None, connect=settings.HTTP_CONNECT_TIMEOUT),
+        )
+
+    @property
+    def redis(self) -> Redis:
+        """Shared Redis client backed by the bounded connection pool."""
+        if self._redis is None:
+            self._create_redis()
+        return self._redis
+
+    @property
+    def redis_bytes(self) -> Redis:
+        """Shared Redis client that returns raw bytes, for binary payloads."""
+        if self._redis_bytes is None:
+            self._create_redis_bytes()
+        return self._redis_bytes
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Shared keep-alive HTTP client for Ollama."""
+        if self._http is None or self._http.is_closed:
+            self._create_http()
+        return self._http
+
+    def use(self, redis: Redis | None = None, redis_bytes: Redis | None = None, http: httpx.AsyncClient | None = None):
+        """Swap in externally created clients, e.g. in-memory fakes for benchmarks."""
+        if redis is not None:
+            self._redis = redis
+        if redis_bytes is not None:
+            self._redis_bytes = redis_bytes
+        if http is not None:
+            self._http = http
+
+    @asynccontextmanager
+    async def schema_lock(self, name: str = "lock:schema", timeout: float = settings.SCHEMA_LOCK_TIMEOUT):
+        """Hold the cross-worker lock around schema changes (indexes, collections).
+
+        Workers starting together then set things up one at a time instead of
+        racing. If Redis is unreachable or the lock is not released in time,
+        the block runs anyway: every schema change here is idempotent. Data
+        migrations take a lock of their own `name` and a longer `timeout`.
+        """
+        lock = self.redis.lock(name, timeout=timeout, blocking_timeout=timeout)
+        try:
+            acquired = await lock.acquire()
+        except RedisError as e:
+            logger.warning("Could not take the schema lock, continuing without it: %s", e)
+            acquired = False
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    await lock.release()
+                except LockError:
+                    # Held past its timeout and already expired
+                    pass
+
+    async def startup(self):
+        """Open the pools. Called once from the application lifespan."""
+        self.redis
+        self.http
+
+    async def shutdown(self):
+        """Close the pools and drop every pooled connection."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+        if self._redis_pool is not None:
+            await self._redis_pool.aclose()
+            self._redis_pool = None
+        if self._redis_bytes is not None:
+            await self._redis_bytes.aclose()
+            self._redis_bytes = None
+        if self._redis_bytes_pool is not None:
+            await self._redis_bytes_pool.aclose()
+            self._redis_bytes_pool = None
+
+    def stats(self) -> dict:
+        """Current pool usage, for the /stats endpoint."""
+        stats = {}
+        for name, pool in (("redis", self._redis_pool), ("redis_bytes", self._redis_bytes_pool)):
+            stats[name] = {"max": settings.REDIS_MAX_CONNECTIONS, "in_use": 0, "idle": 0}
+            if pool is not None:
+                stats[name]["in_use"] = len(pool._in_use_connections)
+                stats[name]["idle"] = len(pool._available_connections)
+
+        http_stats = {"max": settings.HTTP_MAX_CONNECTIONS, "in_use": 0, "idle": 0}
+        if self._http is not None and not self._http.is_closed:
+            # httpcore keeps its connection list on the transport's pool.
+            pool = getattr(self._http._transport, "_pool", None)
+            for conn in getattr(pool, "connections", []):
+                if conn.is_idle():
+                    http_stats["idle"] += 1
+                else:
+                    http_stats["in_use"] += 1
+
+        stats["http"] = http_stats
+        return stats
+
+clients = ClientManager()
@@ -1,9 +1,11 @@
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     APP_NAME: str = "Local-Mind"
     DEBUG: bool = False
     DEFAULT_MODEL: str = "gemma:2b"
+    ACTIVE_MODEL_CACHE_TTL: float = 30.0
 
     
     # Database URLs
@@ -11,6 +13,133 @@ class Settings(BaseSettings):
     QDRANT_URL: str
     OLLAMA_URL: str
 
+    # Vector Store: "qdrant", or "local" for the embedded in-process index
+    # (single worker only: a second process refuses to open LOCAL_INDEX_PATH)
+    VECTOR_BACKEND: Literal["qdrant", "local"] = "qdrant"
+    LOCAL_INDEX_PATH: str = "data/vectors"
+
+    # Qdrant Transport
+    QDRANT_PREFER_GRPC: bool = False
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_TIMEOUT: int = 10
+
+    # Qdrant Collections (one per embedding model and dimension)
+    QDRANT_COLLECTION_PREFIX: str = "knowledge_base"
+    QDRANT_QUANTIZATION: Literal["none", "scalar", "binary"] = "scalar"
+    QDRANT_QUANTIZATION_ALWAYS_RAM: bool = True
+    QDRANT_QUANTIZATION_RESCORE: bool = True
+    QDRANT_QUANTIZATION_OVERSAMPLING: float = 2.0
+    QDRANT_ON_DISK_VECTORS: bool = False
+    QDRANT_HNSW_M: int = 16
+    QDRANT_HNSW_EF_CONSTRUCT: int = 100
+    QDRANT_SEARCH_EF: Optional[int] = None
+
+    # Startup: dependency checks and schema setup run concurrently, each given
+    # STARTUP_TIMEOUT seconds; schema changes are serialized across workers
+    # by a Redis lock held for at most SCHEMA_LOCK_TIMEOUT seconds. Data
+    # migrations run in the background under their own locks, held for at
+    # most MIGRATION_LOCK_TIMEOUT seconds
+    STARTUP_TIMEOUT: float = 10.0
+    READINESS_TIMEOUT: float = 2.0
+    SCHEMA_LOCK_TIMEOUT: float = 60.0
+    MIGRATION_LOCK_TIMEOUT: float = 3600.0
+
+    # Connection Pools
+    REDIS_MAX_CONNECTIONS: int = 64
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    # Read timeout for Ollama calls that do not generate (listing, deleting
+    # models); generation and model loads stay unbounded
+    HTTP_READ_TIMEOUT: float = 10.0
+
+    # Ollama Hosts: OLLAMA_URLS lists several comma-separated backends to route
+    # requests across; OLLAMA_URL alone is used when it is empty
+    OLLAMA_URLS: str = ""
+    OLLAMA_KEEP_ALIVE: str = "30m"
+    OLLAMA_NUM_CTX: Optional[int] = None
+    OLLAMA_PS_INTERVAL: float = 15.0
+
+    # Ollama Scheduling: concurrent requests per host and queue bounds per class
+    OLLAMA_MAX_CONCURRENCY: int = 2
+    OLLAMA_CHAT_QUEUE_SIZE: int = 64
+    OLLAMA_EMBEDDING_QUEUE_SIZE: int = 256
+    OLLAMA_BACKGROUND_QUEUE_SIZE: int = 32
+    # Titles and summaries still waiting after this many seconds are dropped
+    OLLAMA_BACKGROUND_DEADLINE: float = 30.0
+
+    # Embedding Cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_SIZE: int = 4096
+    EMBEDDING_CACHE_TTL: int = 604800
+
+    # Embedding Batching
+    EMBEDDING_BATCH_ENABLED: bool = True
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+
+    # Long-Term Memory Writes
+    FACT_QUEUE_MAX_SIZE: int = 10000
+    FACT_BATCH_SIZE: int = 256
+    FACT_FLUSH_INTERVAL: float = 1.0
+    FACT_DEDUP_ENABLED: bool = True
+    FACT_DEDUP_THRESHOLD: float = 0.95
+
+    # Response Cache (opt-in)
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_SIZE: int = 1024
+    RESPONSE_CACHE_TTL: int = 3600
+    RESPONSE_CACHE_THRESHOLD: float = 0.97
+
+    # Bulk Ingestion
+    INGEST_CHUNK_CHARS: int = 1000
+    INGEST_CONCURRENCY: int = 8
+    INGEST_BATCH_SIZE: int = 512
+    INGEST_QUEUE_SIZE: int = 1024
+
+    # Session Storage: sessions idle for SESSION_IDLE_SECONDS, or beyond the
+    # SESSION_HOT_LIMIT most recently active, move to a compressed archive
+    # ("redis" or "disk") and are rehydrated when opened again
+    SESSION_ARCHIVE: Literal["redis", "disk"] = "redis"
+    SESSION_ARCHIVE_PATH: str = "data/sessions"
+    SESSION_IDLE_SECONDS: int = 3600
+    SESSION_HOT_LIMIT: int = 1000
+    SESSION_ARCHIVE_INTERVAL: float = 300.0
+
+    # Context Window
+    CONTEXT_TOKEN_BUDGET: int = 2048
+    CONTEXT_MAX_MESSAGES: int = 64
+    CONTEXT_SUMMARY_ENABLED: bool = True
+    CONTEXT_SUMMARY_MIN_MESSAGES: int = 8
+    # Each summary update folds in at most this many messages (and tokens);
+    # a longer backlog is folded over several consecutive updates
+    CONTEXT_SUMMARY_BATCH_MESSAGES: int = 16
+    CONTEXT_SUMMARY_BATCH_TOKENS: int = 1024
+    # Where retrieved facts go: in the system prompt, or just before the newest
+    # user message so the rest of the prompt stays cacheable ("prefix_stable")
+    PROMPT_LAYOUT: Literal["system", "prefix_stable"] = "system"
+    # With "prefix_stable", the window's first message moves forward this many
+    # messages at a time, so earlier turns stay identical between steps
+    CONTEXT_WINDOW_STEP: int = 16
+    MEMORY_TOKEN_BUDGET: int = 512
+
+    # Chat Websocket: tokens are sent in frames of up to WS_FRAME_MAX_CHARS,
+    # at most WS_FRAME_INTERVAL_MS apart
+    WS_FRAME_INTERVAL_MS: float = 50.0
+    WS_FRAME_MAX_CHARS: int = 256
+
+    # Chat Turn
+    RETRIEVAL_TIMEOUT: float = 1.5
+    # Which facts a chat turn searches: its session's, its user's (from the
+    # websocket's user_id query parameter) or all of them
+    RETRIEVAL_SCOPE: Literal["session", "user", "global"] = "session"
+    RETRIEVAL_INCLUDE_SHARED: bool = True
+    RETRIEVAL_MAX_AGE: Optional[int] = None
+    RETRIEVAL_SCORE_THRESHOLD: Optional[float] = None
+
     class Config:
         env_file = ".env"
 
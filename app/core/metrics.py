@@ -0,0 +1,89 @@
+import functools
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+# Buckets for operations that involve the LLM and can take seconds to minutes
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+EMBEDDING_SECONDS = Histogram(
+    "localmind_embedding_seconds", "Time to produce an embedding", ["source"]
+)
+EMBEDDING_CACHE = Counter(
+    "localmind_embedding_cache_total", "Embedding cache lookups", ["result"]
+)
+RESPONSE_CACHE = Counter(
+    "localmind_response_cache_total", "Response cache lookups", ["result"]
+)
+OLLAMA_REQUEST_SECONDS = Histogram(
+    "localmind_ollama_request_seconds", "Ollama request latency", ["endpoint"], buckets=SLOW_BUCKETS
+)
+OLLAMA_TTFT_SECONDS = Histogram(
+    "localmind_ollama_time_to_first_token_seconds", "Time from chat request to first token", buckets=SLOW_BUCKETS
+)
+PROMPT_EVAL_SECONDS = Histogram(
+    "localmind_ollama_prompt_eval_seconds", "Prompt processing time reported by Ollama, by prompt layout", ["layout"], buckets=SLOW_BUCKETS
+)
+PROMPT_EVAL_TOKENS = Counter(
+    "localmind_ollama_prompt_eval_tokens_total", "Prompt tokens Ollama evaluated (not served from its cache), by prompt layout", ["layout"]
+)
+GENERATION_SECONDS = Histogram(
+    "localmind_generation_seconds", "Total chat generation time", buckets=SLOW_BUCKETS
+)
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "localmind_generation_tokens_per_second", "Decode speed of chat generations",
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 200),
+)
+GENERATED_TOKENS = Counter(
+    "localmind_generated_tokens_total", "Tokens generated by chat calls"
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "localmind_ollama_model_load_seconds", "Model load time, from warm-ups and as reported by Ollama for chats", ["trigger"], buckets=SLOW_BUCKETS
+)
+MODEL_RESIDENT = Gauge(
+    "localmind_ollama_model_resident", "Models loaded on each Ollama host", ["host", "model"]
+)
+OLLAMA_IN_FLIGHT = Gauge(
+    "localmind_ollama_in_flight", "Ollama requests holding a scheduler slot"
+)
+OLLAMA_QUEUE_DEPTH = Gauge(
+    "localmind_ollama_queue_depth", "Requests waiting for an Ollama slot", ["priority"]
+)
+OLLAMA_QUEUE_WAIT_SECONDS = Histogram(
+    "localmind_ollama_queue_wait_seconds", "Time spent waiting for an Ollama slot", ["priority"], buckets=SLOW_BUCKETS
+)
+OLLAMA_REJECTED = Counter(
+    "localmind_ollama_rejected_total", "Requests turned away by the Ollama scheduler", ["priority", "reason"]
+)
+VECTOR_SECONDS = Histogram(
+    "localmind_vector_seconds", "Vector store operation latency", ["op"]
+)
+REDIS_SECONDS = Histogram(
+    "localmind_redis_seconds", "Redis operation latency", ["op"]
+)
+CHAT_STAGE_SECONDS = Histogram(
+    "localmind_chat_stage_seconds", "Duration of each stage of a chat turn", ["stage"], buckets=SLOW_BUCKETS
+)
+SESSION_TIER_MOVES = Counter(
+    "localmind_session_tier_moves_total", "Sessions archived to or rehydrated from the cold tier", ["direction"]
+)
+ACTIVE_SESSIONS = Gauge(
+    "localmind_active_websocket_sessions", "Open chat websocket connections"
+)
+BACKGROUND_BACKLOG = Gauge(
+    "localmind_background_backlog", "Items waiting in background queues", ["queue"]
+)
+
+def timed(histogram: Histogram, label: str):
+    """Decorator recording the duration of an async function in `histogram`."""
+    child = histogram.labels(label)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
@@ -1,12 +1,63 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.core.config import settings
-import redis.asyncio as redis
-from qdrant_client import QdrantClient
+from app.core.clients import clients
+from app.core.metrics import BACKGROUND_BACKLOG
 
 from app.routers import chat, memory, knowledge, llm
+from app.services.embedding_cache import embedding_cache
+from app.services.response_cache import response_cache
+from app.services.llm import llm_service
+from app.services.model_manager import model_manager
+from app.services.memory import memory_service
+from app.services.vectors import LEGACY_COLLECTION, vector_service
+from app.services.fact_writer import fact_writer
+from app.services.chat_turn import turn_stats
+from app.services.context import context_service
 
-app = FastAPI(title=settings.APP_NAME, debug=settings.DEBUG)
+# DEBUG turns on the per-request debug logs; they cost nothing when disabled
+logging.basicConfig(
+    level=logging.DEBUG if settings.DEBUG else logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+# httpx logs every Ollama request at INFO; keep that off the hot path unless debugging
+for name in ("httpx", "httpcore"):
+    logging.getLogger(name).setLevel(logging.DEBUG if settings.DEBUG else logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Startup work left running in the background, kept referenced until it finishes
+_background: set[asyncio.Task] = set()
+
+BACKGROUND_BACKLOG.labels("fact_writer").set_function(lambda: fact_writer.queue.qsize())
+BACKGROUND_BACKLOG.labels("embedding_batcher").set_function(lambda: llm_service.embedding_batcher.stats()["pending"])
+BACKGROUND_BACKLOG.labels("summaries").set_function(lambda: context_service.pending)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await clients.startup()
+    await startup_event()
+    await fact_writer.start()
+    await llm_service.start_model_listener()
+    await model_manager.start()
+    await memory_service.start_archiver()
+    yield
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    await memory_service.stop_archiver()
+    await model_manager.stop()
+    await llm_service.stop_model_listener()
+    await fact_writer.stop()
+    await vector_service.close()
+    await clients.shutdown()
+
+app = FastAPI(title=settings.APP_NAME, debug=settings.DEBUG, lifespan=lifespan)
 
 # Add CORS Middleware
 app.add_middleware(
@@ -15,6 +66,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(chat.router)
@@ -23,32 +75,104 @@ app.include_router(knowledge.router)
 app.include_router(llm.router)
 
 
-@app.on_event("startup")
 async def startup_event():
-    # Verify Redis Connection
+    """Check the dependencies and prepare storage, all at once.
+
+    Each step gets STARTUP_TIMEOUT seconds. A failure is logged rather than
+    raised so the worker still starts; /ready reports whether it can serve.
+    """
+    await asyncio.gather(_startup_step("Redis", clients.redis.ping()), _startup_step("vector store", vector_service.setup()))
+
+    # Backfilling the session indexes may take a while on a large deployment;
+    # it must not be cut short by the startup timeout
+    _run_in_background(_backfill_sessions())
+
+    # Ensure Default Model and load the active one (Async)
+    logger.info("🚀 Triggering auto-pull for default model: %s", settings.DEFAULT_MODEL)
+    _run_in_background(_prepare_models())
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def _prepare_models():
     try:
-        r = redis.from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
-        await r.ping()
-        print(f"✅ Connected to Redis at {settings.REDIS_URL}")
-        await r.close()
+        await llm_service.prepare_models()
     except Exception as e:
-        print(f"❌ Failed to connect to Redis: {e}")
+        logger.error("❌ Failed to prepare the models: %r", e)
+    if settings.VECTOR_BACKEND == "qdrant":
+        await _adopt_legacy_facts()
 
-    # Verify Qdrant Connection
+async def _adopt_legacy_facts():
+    # Facts stored before per-model collections become the memory of the active
+    # model, if its embeddings have the size of the old collection
     try:
-        qdrant = QdrantClient(url=settings.QDRANT_URL)
-        # Simple check: list collections
-        qdrant.get_collections()
-        print(f"✅ Connected to Qdrant at {settings.QDRANT_URL}")
+        model = await llm_service.get_active_model()
+        probe = await llm_service.generate_embedding("dimension probe", model)
+        if probe:
+            await vector_service.adopt_legacy(model, len(probe))
     except Exception as e:
-        print(f"❌ Failed to connect to Qdrant: {e}")
+        logger.error("❌ Failed to move the facts of %s: %r", LEGACY_COLLECTION, e)
 
-    # Ensure Default Model (Async)
-    from app.services.llm import llm_service
-    import asyncio
-    print(f"🚀 Triggering auto-pull for default model: {settings.DEFAULT_MODEL}")
-    asyncio.create_task(llm_service.pull_model(settings.DEFAULT_MODEL))
+async def _backfill_sessions():
+    try:
+        await memory_service.ensure_session_index()
+    except Exception as e:
+        logger.error("❌ Failed to backfill the session indexes: %r", e)
+
+async def _startup_step(name: str, step):
+    try:
+        await asyncio.wait_for(step, settings.STARTUP_TIMEOUT)
+        logger.info("✅ %s is ready", name)
+    except Exception as e:
+        logger.error("❌ Failed to prepare %s: %r", name, e)
+
+async def _check(probe) -> str:
+    try:
+        await asyncio.wait_for(probe, settings.READINESS_TIMEOUT)
+        return "ok"
+    except Exception as e:
+        return f"error: {e!r}"
 
 @app.get("/")
 def health_check():
+    """Liveness: the process is up. Does not touch any dependency."""
     return {"status": "ok", "service": settings.APP_NAME}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: Redis and the vector store answer within READINESS_TIMEOUT.
+
+    Ollama is reported but not required, since models load in the background
+    and hosts come and go.
+    """
+    redis, vectors = await asyncio.gather(_check(clients.redis.ping()), _check(vector_service.ping()))
+    ready = redis == "ok" and vectors == "ok"
+    body = {
+        "status": "ready" if ready else "unavailable",
+        "redis": redis,
+        "vectors": vectors,
+        "ollama": {host.url: "ok" if host.healthy else "unreachable" for host in model_manager.hosts},
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics for this worker."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+def stats():
+    """Connection pool and cache usage for this worker."""
+    return {
+        "pools": clients.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "embedding_batcher": llm_service.embedding_batcher.stats(),
+        "ollama": model_manager.stats(),
+        "fact_writer": fact_writer.stats(),
+        "chat_turns": turn_stats.stats(),
+        "sessions": memory_service.stats(),
+        "vectors": {"collections": vector_service.collections(), "dimensions": vector_service.dimensions},
+    }
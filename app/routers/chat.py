@@ -1,10 +1,17 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException, Query, Response
 from pydantic import BaseModel
-from typing import List, Optional
-from app.services.memory import memory_service
-from app.services.vectors import vector_service
+from typing import List, Literal, Optional
+from app.core.config import settings
+from app.core.metrics import ACTIVE_SESSIONS
+from app.services.memory import InvalidCursor, memory_service
 from app.services.llm import llm_service
+from app.services.chat_turn import ChatTurn
+from app.services.response_cache import fingerprint, response_cache
 import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -17,8 +24,20 @@ class CreateSessionRequest(BaseModel):
     title: Optional[str] = "New Chat"
 
 @router.get("/sessions", response_model=List[SessionResponse])
-async def get_sessions():
-    return await memory_service.list_sessions()
+async def get_sessions(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    order: Literal["created", "activity"] = "created",
+):
+    """List sessions newest first. The next page's cursor is sent in the X-Next-Cursor header."""
+    try:
+        sessions, next_cursor = await memory_service.list_sessions(limit=limit, cursor=cursor, order=order)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return sessions
 
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(request: CreateSessionRequest):
@@ -33,66 +52,170 @@ async def summarize_session(session_id: str, first_message: str):
     # Delay slightly to let the chat flow continue
     await asyncio.sleep(2)
     
-    prompt = f"Summarize the following message into a short title (max 5 words). Do not use quotes. Message: {first_message}"
-    messages = [{"role": "user", "content": prompt}]
-    
-    title = ""
-    # We reuse stream_chat but just collect the full text
-    async for token in llm_service.stream_chat(messages):
-        title += token
-    
-    title = title.strip().replace('"', '').replace("Title:", "").strip()
+    instruction = "Summarize the following message into a short title (max 5 words). Do not use quotes. Message: "
+    messages = [{"role": "user", "content": instruction + first_message}]
+
+    # Generic first messages ("hi", "help me with code") get the same title again
+    model = await llm_service.get_active_model()
+    cache_key = None
+    if settings.RESPONSE_CACHE_ENABLED:
+        embedding = await llm_service.generate_embedding(first_message, model)
+        cache_key = (fingerprint(instruction), embedding) if embedding else None
+    title = response_cache.get(model, *cache_key) if cache_key else None
+
+    if title is None:
+        title = ""
+        # We reuse stream_chat but just collect the full text
+        async for token in llm_service.stream_chat(messages, priority="background", deadline=settings.OLLAMA_BACKGROUND_DEADLINE):
+            title += token
+        title = title.strip().replace('"', '').replace("Title:", "").strip()
+        if title.startswith("Error:"):
+            return
+        if cache_key and title:
+            response_cache.set(model, *cache_key, title)
+
     if title:
         await memory_service.update_session_title(session_id, title)
 
 
-@router.websocket("/ws/chat/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await websocket.accept()
+# Sent by the client as a text frame to stop the answer being generated
+STOP_MESSAGE = {"type": "stop"}
+# Sent after the last frame of a complete answer; coalesce never yields an empty frame
+END_OF_ANSWER = ""
+
+async def coalesce(tokens, interval: float, max_chars: int):
+    """Group streamed tokens into frames of up to `max_chars`, sent at most `interval` seconds apart.
+
+    The first frame goes out as soon as it arrives so time to first token is
+    unchanged; empty tokens never produce a frame.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+        finally:
+            queue.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    loop = asyncio.get_running_loop()
+    buffer = ""
+    flush_at = None
+    first = True
     try:
         while True:
-            # 1. Receive User Message
-            data = await websocket.receive_text()
-            
-            # 2. Save User Message to Redis
-            await memory_service.add_message(session_id, "user", data)
-            
-            # 3. Retrieve Context (History + RAG)
-            history = await memory_service.get_history(session_id)
-            
-            # If history was empty BEFORE this new user message (which we just added),
-            # it means this is the start of the conversation. 
-            # Note: We added the user message in step 2, so history will have 1 item now if it was new.
-            # Let's check if there is only 1 message (the one we just added).
-            full_history = await memory_service.get_history(session_id)
-            if len(full_history) == 1:
-                 asyncio.create_task(summarize_session(session_id, data))
-            
-            # RAG: Search for relevant facts (Simple implementation)
-            # In a real app we'd embedding the 'data' first.
-            query_embedding = await llm_service.generate_embedding(data)
-            relevant_facts = []
-            if query_embedding:
-                relevant_facts = vector_service.search_relevant(query_embedding)
-            
-            # Filter out facts that collide exactly with the query (to avoid redundancy)
-            relevant_facts = [f for f in relevant_facts if f.strip() != data.strip()]
-
-            context_str = "\n".join(relevant_facts)
-
-            # 4. Stream Response
-            full_response = ""
-            async for token in llm_service.stream_chat(history, context_text=context_str):
-                await websocket.send_text(token)
-                full_response += token
-            
-            # 5. Save AI Response to Redis
-            await memory_service.add_message(session_id, "assistant", full_response)
-            
-            # 6. Store User Message in Long-Term Memory (Dreaming - simplified for now)
-            # We blindly upsert the user message as a "fact" for now to test Qdrant
-            if query_embedding:
-                vector_service.upsert_fact(data, query_embedding)
+            timeout = None if flush_at is None else max(0.0, flush_at - loop.time())
+            try:
+                token = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield buffer
+                buffer, flush_at = "", None
+                continue
+            if token is None:
+                break
+            if not token:
+                continue
+            buffer += token
+            if first or len(buffer) >= max_chars:
+                yield buffer
+                buffer, flush_at, first = "", None, False
+            elif flush_at is None:
+                flush_at = loop.time() + interval
+        if buffer:
+            yield buffer
+        # Surface errors from the token stream
+        await producer
+    finally:
+        # Closing the frames early (stop, disconnect) cancels the upstream request
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
 
+async def run_turn(websocket: WebSocket, session_id: str, user_id: Optional[str], message: str):
+    """Answer one message, saving whatever was generated even if the turn is cancelled."""
+    turn = ChatTurn(session_id, message, user_id)
+    try:
+        # Store the message and load history while retrieving memory context
+        await turn.prepare()
+        if turn.is_first:
+            asyncio.create_task(summarize_session(session_id, message))
+
+        # Stream the response in coalesced frames
+        frames = coalesce(turn.stream(), settings.WS_FRAME_INTERVAL_MS / 1000, settings.WS_FRAME_MAX_CHARS)
+        try:
+            async for frame in frames:
+                await websocket.send_text(frame)
+        finally:
+            await frames.aclose()
+        await websocket.send_text(END_OF_ANSWER)
+    except asyncio.CancelledError:
+        turn.cancelled = True
+        raise
+    except WebSocketDisconnect:
+        turn.cancelled = True
+    except Exception as e:
+        logger.error("Chat turn for %s failed: %s", session_id, e)
+        try:
+            await websocket.send_text(END_OF_ANSWER)
+        except Exception:
+            pass
+    finally:
+        if turn.prepared:
+            # Save the (possibly partial) answer and store the message in long-term memory.
+            # Shielded so a cancelled turn still gets saved.
+            await asyncio.shield(turn.finish())
+
+async def receive_messages(websocket: WebSocket, inbox: asyncio.Queue):
+    """Read client frames into `inbox`; None marks the disconnect."""
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                control = json.loads(data)
+            except ValueError:
+                control = None
+            inbox.put_nowait(STOP_MESSAGE if control == STOP_MESSAGE else data)
     except WebSocketDisconnect:
-        print(f"Session {session_id} disconnected")
+        pass
+    finally:
+        inbox.put_nowait(None)
+
+async def cancel_turn(task: asyncio.Task | None):
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+@router.websocket("/ws/chat/{session_id}")
+async def websocket_endpoint(websocket: WebSocket, session_id: str, user_id: Optional[str] = None):
+    """Chat over a websocket: the client sends messages as text frames, the answer streams back as text frames.
+
+    Receiving runs alongside generation, so a disconnect, a {"type": "stop"}
+    frame or a new message stops the current answer at once. Whatever was
+    generated up to that point is saved. An empty frame ends every answer
+    that was not stopped.
+    """
+    await websocket.accept()
+    ACTIVE_SESSIONS.inc()
+    inbox: asyncio.Queue = asyncio.Queue()
+    receiver = asyncio.create_task(receive_messages(websocket, inbox))
+    turn: asyncio.Task | None = None
+    try:
+        while True:
+            data = await inbox.get()
+            if data is None:
+                logger.info("Session %s disconnected", session_id)
+                break
+            await cancel_turn(turn)
+            if data is not STOP_MESSAGE:
+                turn = asyncio.create_task(run_turn(websocket, session_id, user_id, data))
+    finally:
+        await cancel_turn(turn)
+        receiver.cancel()
+        ACTIVE_SESSIONS.dec()
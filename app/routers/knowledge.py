@@ -1,6 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
+from app.core.config import settings
 from app.services.vectors import vector_service
 from app.services.llm import llm_service
+from app.services.fact_writer import fact_writer
+from app.services.compaction import compact_facts
+from app.services.ingestion import ingestion_service, read_document, read_ndjson
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/knowledge", tags=["Knowledge"])
@@ -8,26 +13,91 @@ router = APIRouter(prefix="/knowledge", tags=["Knowledge"])
 class SearchQuery(BaseModel):
     query: str
     limit: int = 3
+    # Scope: facts of this session and/or user (plus shared ones unless include_shared
+    # is False), last seen at or after `since` (unix seconds). No scope searches everything.
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    since: Optional[int] = None
+    include_shared: bool = True
+    score_threshold: Optional[float] = None
 
 class FactInput(BaseModel):
     text: str
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    source: str = "manual"
 
 @router.post("/search")
 async def search_knowledge(search: SearchQuery):
     """Debug endpoint: Search the vector database for relevant facts."""
-    embedding = await llm_service.generate_embedding(search.query)
+    model = await llm_service.get_active_model()
+    embedding = await llm_service.generate_embedding(search.query, model)
     if not embedding:
         raise HTTPException(status_code=500, detail="Failed to generate embedding")
     
-    results = vector_service.search_relevant(embedding, limit=search.limit)
+    results = await vector_service.search_relevant(
+        embedding,
+        model,
+        limit=search.limit,
+        session_id=search.session_id,
+        user_id=search.user_id,
+        since=search.since,
+        include_shared=search.include_shared,
+        score_threshold=search.score_threshold,
+    )
     return {"results": results}
 
 @router.post("/add")
 async def add_fact(fact: FactInput):
     """Manually add a piece of knowledge to the vector DB."""
-    embedding = await llm_service.generate_embedding(fact.text)
+    model = await llm_service.get_active_model()
+    embedding = await llm_service.generate_embedding(fact.text, model)
     if not embedding:
         raise HTTPException(status_code=500, detail="Failed to generate embedding")
     
-    vector_service.upsert_fact(fact.text, embedding)
-    return {"status": "success", "message": "Fact added to knowledge base"}
+    meta = {"session_id": fact.session_id, "user_id": fact.user_id, "source": fact.source}
+    await fact_writer.enqueue(fact.text, embedding, model, meta)
+    return {"status": "success", "message": "Fact queued for the knowledge base"}
+
+@router.post("/compact")
+async def compact_knowledge(background_tasks: BackgroundTasks):
+    """Merge near-duplicate facts in the background."""
+    if settings.VECTOR_BACKEND == "local":
+        raise HTTPException(status_code=501, detail="Compaction is not supported with VECTOR_BACKEND=local")
+    background_tasks.add_task(compact_facts)
+    return {"status": "started", "message": "Compacting knowledge base in background"}
+
+@router.post("/ingest")
+async def ingest_knowledge(
+    request: Request,
+    job_id: Optional[str] = None,
+    source: str = "ingest",
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
+    """Bulk-load knowledge from the streamed request body.
+
+    Send NDJSON (`application/x-ndjson`, one {"text": ...} per line) or a
+    text/markdown document (`text/*`). Chunks are shared knowledge unless a
+    session_id or user_id is given. Returns once the body is read; poll
+    GET /knowledge/ingest/{job_id} for progress.
+    """
+    content_type = request.headers.get("content-type", "text/plain")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        chunks = read_ndjson(request.stream())
+    elif content_type.startswith("text/"):
+        chunks = read_document(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Send application/x-ndjson or a text/* document")
+
+    meta = {"source": source, "session_id": session_id, "user_id": user_id}
+    job = await ingestion_service.ingest(chunks, job_id, meta)
+    return job.to_dict()
+
+@router.get("/ingest/{job_id}")
+async def ingest_progress(job_id: str):
+    """Progress counters for an ingestion job."""
+    job = await ingestion_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
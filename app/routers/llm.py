@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from app.services.llm import llm_service
+from app.core.clients import clients
 from app.core.config import settings
-import httpx
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/llm", tags=["LLM"])
@@ -12,16 +12,15 @@ class ModelRequest(BaseModel):
 @router.get("/models")
 async def list_models():
     """List available models from the local Ollama instance."""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{settings.OLLAMA_URL}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                active_model = await llm_service.get_active_model()
-                return {"models": models, "active_model": active_model}
-            return {"error": "Failed to fetch models", "details": response.text}
-        except Exception as e:
-            return {"error": "Connection failed", "details": str(e)}
+    try:
+        response = await clients.http.get(f"{settings.OLLAMA_URL}/api/tags", timeout=settings.HTTP_READ_TIMEOUT)
+        if response.status_code == 200:
+            models = response.json().get("models", [])
+            active_model = await llm_service.get_active_model()
+            return {"models": models, "active_model": active_model}
+        return {"error": "Failed to fetch models", "details": response.text}
+    except Exception as e:
+        return {"error": "Connection failed", "details": str(e)}
 
 @router.get("/active")
 async def get_active_model():
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from app.core.config import settings
+from app.core.metrics import CHAT_STAGE_SECONDS
+from app.services.context import context_service
+from app.services.fact_writer import fact_writer
+from app.services.llm import llm_service
+from app.services.memory import memory_service
+from app.services.response_cache import fingerprint, replay, response_cache
+from app.services.vectors import vector_service
+
+logger = logging.getLogger(__name__)
+
+class TurnStats:
+    """Running per-stage averages over all chat turns in this worker."""
+
+    def __init__(self):
+        self.turns = 0
+        self.retrieval_timeouts = 0
+        self.cancelled = 0
+        self._totals: dict[str, float] = {}
+        self._counts: dict[str, int] = {}
+
+    def record(self, turn: "ChatTurn"):
+        self.turns += 1
+        if turn.retrieval_timed_out:
+            self.retrieval_timeouts += 1
+        if turn.cancelled:
+            self.cancelled += 1
+        for stage, ms in turn.timings.items():
+            self._totals[stage] = self._totals.get(stage, 0.0) + ms
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "retrieval_timeouts": self.retrieval_timeouts,
+            "cancelled": self.cancelled,
+            "avg_stage_ms": {stage: self._totals[stage] / self._counts[stage] for stage in self._totals},
+        }
+
+turn_stats = TurnStats()
+
+class ChatTurn:
+    """One user message through the chat pipeline, split into explicit stages.
+
+    `prepare` stores the message and loads history while, concurrently,
+    embedding the message and searching Qdrant. Retrieval has a deadline;
+    past it the turn proceeds without RAG context. `stream` yields the answer
+    and `finish` persists it. Stage durations land in `timings` (ms).
+    """
+
+    def __init__(self, session_id: str, message: str, user_id: str | None = None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.message = message
+        self.started = time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.is_first = False
+        self.history: list[dict] = []
+        self.context_text = ""
+        self.response = ""
+        self.retrieval_timed_out = False
+        self.cached = False
+        self.prepared = False
+        self.cancelled = False
+        self.model = ""
+        self._embedding_task: asyncio.Task | None = None
+
+    @contextmanager
+    def _stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (time.perf_counter() - started) * 1000
+
+    async def _load_history(self):
+        with self._stage("store"):
+            length = await memory_service.add_message(self.session_id, "user", self.message)
+        # A list of length 1 means this is the start of the conversation
+        self.is_first = length == 1
+        with self._stage("history"):
+            self.history = await context_service.build(self.session_id)
+
+    async def _retrieve(self) -> list[str]:
+        with self._stage("embedding"):
+            # Shielded so a retrieval timeout does not discard the embedding,
+            # which is still needed to store the message as a fact.
+            embedding = await asyncio.shield(self._embedding_task)
+        if not embedding:
+            return []
+        with self._stage("search"):
+            facts = await vector_service.search_relevant(embedding, self.model, **self._scope())
+        # Filter out facts that collide exactly with the query (to avoid redundancy)
+        return [f for f in facts if f.strip() != self.message.strip()]
+
+    def _scope(self) -> dict:
+        """Search scope for this turn, from RETRIEVAL_SCOPE and RETRIEVAL_MAX_AGE."""
+        scope = {
+            "include_shared": settings.RETRIEVAL_INCLUDE_SHARED,
+            "score_threshold": settings.RETRIEVAL_SCORE_THRESHOLD,
+        }
+        if settings.RETRIEVAL_SCOPE == "user" and self.user_id:
+            scope["user_id"] = self.user_id
+        elif settings.RETRIEVAL_SCOPE != "global":
+            # A connection without a user falls back to its session
+            scope["session_id"] = self.session_id
+        if settings.RETRIEVAL_MAX_AGE is not None:
+            scope["since"] = int(time.time()) - settings.RETRIEVAL_MAX_AGE
+        return scope
+
+    async def _retrieve_with_deadline(self) -> list[str]:
+        try:
+            return await asyncio.wait_for(self._retrieve(), settings.RETRIEVAL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.retrieval_timed_out = True
+            logger.warning("Retrieval exceeded %ss, answering without memory context", settings.RETRIEVAL_TIMEOUT)
+        except Exception as e:
+            logger.error("Retrieval failed, answering without memory context: %s", e)
+        return []
+
+    async def prepare(self):
+        """Run the history and retrieval stages concurrently."""
+        with self._stage("prepare"):
+            # Pin the model so the vector is searched and stored where it belongs
+            self.model = await llm_service.get_active_model()
+            self._embedding_task = asyncio.create_task(llm_service.generate_embedding(self.message, self.model))
+            _, facts = await asyncio.gather(self._load_history(), self._retrieve_with_deadline())
+        self.context_text = context_service.format_memory(facts, self.history)
+        self.prepared = True
+
+    def _cache_key(self) -> tuple[str, list[float]] | None:
+        """Response cache fingerprint and question embedding, if the turn can use the cache."""
+        if not settings.RESPONSE_CACHE_ENABLED or not self._embedding_task.done():
+            return None
+        if self._embedding_task.cancelled() or self._embedding_task.exception() or not self._embedding_task.result():
+            return None
+        # Everything the model sees besides the new question: retrieved facts and earlier turns
+        earlier = [f"{m['role']}: {m['content']}" for m in self.history[:-1]]
+        return fingerprint(self.context_text, *earlier), self._embedding_task.result()
+
+    async def stream(self):
+        """Yield response tokens from the response cache or the LLM, timing the first one."""
+        generation_started = time.perf_counter()
+        cache_key = self._cache_key()
+        cached = response_cache.get(self.model, *cache_key) if cache_key else None
+        if cached is not None:
+            self.cached = True
+            tokens = replay(cached)
+        else:
+            tokens = llm_service.stream_chat(self.history, context_text=self.context_text)
+        async for token in tokens:
+            if "first_token" not in self.timings:
+                self.timings["first_token"] = (time.perf_counter() - self.started) * 1000
+            self.response += token
+            yield token
+        self.timings["generation"] = (time.perf_counter() - generation_started) * 1000
+        if cache_key and not self.cached and not self.response.startswith("Error:"):
+            response_cache.set(self.model, *cache_key, self.response)
+
+    async def finish(self):
+        """Save the answer, partial if the turn was cancelled, and queue the user message for long-term memory."""
+        with self._stage("save"):
+            if self.response:
+                await memory_service.add_message(self.session_id, "assistant", self.response)
+            # We blindly store the user message as a "fact" (Dreaming - simplified for now)
+            try:
+                embedding = await self._embedding_task
+            except Exception:
+                embedding = []
+            if embedding:
+                meta = {"session_id": self.session_id, "user_id": self.user_id, "source": "chat"}
+                await fact_writer.enqueue(self.message, embedding, self.model, meta)
+        self.timings["total"] = (time.perf_counter() - self.started) * 1000
+        turn_stats.record(self)
+        for stage, ms in self.timings.items():
+            CHAT_STAGE_SECONDS.labels(stage).observe(ms / 1000)
+        logger.debug("Turn timings for %s: %s", self.session_id, self.timings)
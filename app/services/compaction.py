@@ -0,0 +1,99 @@
+"""Offline compaction of near-duplicate facts in the knowledge base.
+
+Run it from the API (POST /knowledge/compact) or as a one-off job:
+
+    python -m app.services.compaction
+"""
+import asyncio
+import logging
+from qdrant_client.http import models
+from app.core.config import settings
+from app.services.vectors import VectorService, vector_service
+
+logger = logging.getLogger(__name__)
+
+async def compact_facts(threshold: float = settings.FACT_DEDUP_THRESHOLD, neighbours: int = 16) -> dict:
+    """Compact every knowledge collection (one per embedding model). Qdrant only."""
+    if settings.VECTOR_BACKEND == "local":
+        # The embedded index only folds near-duplicates on write
+        raise NotImplementedError("Compaction is not supported with VECTOR_BACKEND=local")
+    await vector_service.setup()
+    totals = {"scanned": 0, "merged": 0}
+    for collection in vector_service.collections():
+        result = await compact_collection(collection, threshold, neighbours)
+        totals["scanned"] += result["scanned"]
+        totals["merged"] += result["merged"]
+    return totals
+
+def owners(payload: dict) -> tuple:
+    return tuple(sorted(payload.get("sessions", []))), tuple(sorted(payload.get("users", [])))
+
+async def compact_collection(collection: str, threshold: float, neighbours: int) -> dict:
+    """Merge clusters of near-duplicate points into one point each.
+
+    Walks the collection and, for each surviving point, finds neighbours
+    scoring at least `threshold`. The point with the most hits is kept, the
+    others' hit counts are added to it and they are deleted.
+    """
+    client = vector_service.client
+    removed: set[str] = set()
+    scanned = 0
+    merged = 0
+    offset = None
+
+    while True:
+        points, offset = await client.scroll(
+            collection_name=collection,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            point_id = str(point.id)
+            scanned += 1
+            if point_id in removed:
+                continue
+            # Neighbours from other scopes would only use up the limit
+            sessions, users = owners(point.payload)
+            response = await client.query_points(
+                collection_name=collection,
+                query=point.vector,
+                query_filter=VectorService._owner_filter({"sessions": list(sessions), "users": list(users)}),
+                limit=neighbours + 1,
+                score_threshold=threshold,
+                with_payload=True,
+            )
+            # Only facts visible to exactly the same sessions and users are merged
+            cluster = [
+                hit for hit in response.points
+                if str(hit.id) not in removed and owners(hit.payload) == owners(point.payload)
+            ]
+            if len(cluster) < 2:
+                continue
+
+            keep = max(cluster, key=lambda hit: (hit.payload.get("hits", 1), str(hit.id) == point_id))
+            drop = [hit for hit in cluster if hit.id != keep.id]
+            payload = {"hits": sum(hit.payload.get("hits", 1) for hit in cluster)}
+            # Facts stored before dedup existed carry no timestamps
+            seen = [hit.payload["first_seen"] for hit in cluster if "first_seen" in hit.payload]
+            if seen:
+                payload["first_seen"] = min(seen)
+                payload["last_seen"] = max(hit.payload.get("last_seen", 0) for hit in cluster)
+            await client.set_payload(collection_name=collection, payload=payload, points=[keep.id])
+            await client.delete(
+                collection_name=collection,
+                points_selector=models.PointIdsList(points=[hit.id for hit in drop]),
+            )
+            removed.update(str(hit.id) for hit in drop)
+            merged += len(drop)
+
+        if offset is None:
+            break
+
+    logger.info("Compaction of %s finished: scanned %s points, merged %s duplicates", collection, scanned, merged)
+    return {"scanned": scanned, "merged": merged}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(compact_facts())
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.services.memory import memory_service
+from app.services.llm import llm_service
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for budgeting prompts."""
+    return len(text) // 4 + 1
+
+class ContextService:
+    """Builds the chat prompt from a rolling summary plus the most recent turns.
+
+    Only the tail of the session list is read from Redis and trimmed to the
+    token budget. Turns that fall out of the window are folded into a summary
+    in the background, at most CONTEXT_SUMMARY_BATCH_MESSAGES per model call,
+    so the prompt stays bounded no matter how long the conversation gets.
+    """
+
+    def __init__(self):
+        self._summarizing: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """Summary updates currently running."""
+        return len(self._summarizing)
+
+    async def build(self, session_id: str) -> list[dict]:
+        """Return the messages to send to the LLM for this session."""
+        messages, total, summary = await memory_service.get_recent_history(session_id, settings.CONTEXT_MAX_MESSAGES)
+
+        budget = settings.CONTEXT_TOKEN_BUDGET
+        if summary:
+            budget -= estimate_tokens(summary["summary"])
+
+        # Walk back from the newest message; the newest one is always kept.
+        window = []
+        used = 0
+        for message in reversed(messages):
+            cost = estimate_tokens(message["content"])
+            if window and used + cost > budget:
+                break
+            window.append(message)
+            used += cost
+        window.reverse()
+
+        start = total - len(window)
+        upto = summary["upto"] if summary else 0
+        if settings.PROMPT_LAYOUT == "prefix_stable":
+            start = self._stable_start(start, upto, total)
+            window = messages[start - (total - len(messages)):]
+        if settings.CONTEXT_SUMMARY_ENABLED and start - upto >= settings.CONTEXT_SUMMARY_MIN_MESSAGES:
+            self._schedule_summary(session_id, summary["summary"] if summary else "", upto, start)
+
+        if summary:
+            window.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary['summary']}"})
+        return window
+
+    @staticmethod
+    def _stable_start(start: int, upto: int, total: int) -> int:
+        """First window message for the "prefix_stable" layout.
+
+        The window starts where the summary ends, so the prompt only changes
+        at the front when the summary does. When that no longer fits the
+        budget, the start moves forward in CONTEXT_WINDOW_STEP jumps from the
+        summary's end rather than one message per turn. The summary then
+        catches up to the same start, leaving the window itself unchanged.
+        """
+        if upto < start:
+            step = settings.CONTEXT_WINDOW_STEP
+            upto += -(-(start - upto) // step) * step
+        # The newest message is always kept
+        return min(upto, total - 1)
+
+    def format_memory(self, facts: list[str], window: list[dict]) -> str:
+        """Join retrieved facts into the memory context, deduplicated and within MEMORY_TOKEN_BUDGET.
+
+        Facts come best first. Repeats, and facts already present verbatim in
+        the conversation window, are dropped.
+        """
+        seen = {" ".join(m["content"].lower().split()) for m in window}
+        kept = []
+        used = 0
+        for fact in facts:
+            key = " ".join(fact.lower().split())
+            if not key or key in seen:
+                continue
+            cost = estimate_tokens(fact)
+            if used + cost > settings.MEMORY_TOKEN_BUDGET:
+                break
+            seen.add(key)
+            kept.append(fact)
+            used += cost
+        return "\n".join(kept)
+
+    def _schedule_summary(self, session_id: str, previous: str, upto: int, start: int):
+        if session_id in self._summarizing:
+            return
+        self._summarizing.add(session_id)
+        task = asyncio.create_task(self._update_summary(session_id, previous, upto, start))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _update_summary(self, session_id: str, previous: str, upto: int, start: int):
+        """Fold messages [upto, start) into the session's rolling summary, one bounded batch at a time."""
+        try:
+            while upto < start:
+                end = min(start, upto + settings.CONTEXT_SUMMARY_BATCH_MESSAGES)
+                older = await memory_service.get_history_range(session_id, upto, end - 1)
+                if not older:
+                    return
+                batch = []
+                used = 0
+                for message in older:
+                    cost = estimate_tokens(message["content"])
+                    if batch and used + cost > settings.CONTEXT_SUMMARY_BATCH_TOKENS:
+                        break
+                    batch.append(message)
+                    used += cost
+                text = await self._fold(previous, batch)
+                if not text:
+                    return
+                upto += len(batch)
+                # Saved after every batch so an interrupted backlog resumes where it stopped
+                await memory_service.set_summary(session_id, text, upto)
+                previous = text
+        except Exception as e:
+            logger.error("Failed to update summary for %s: %s", session_id, e)
+        finally:
+            self._summarizing.discard(session_id)
+
+    async def _fold(self, previous: str, messages: list[dict]) -> str:
+        """Ask the model for the summary updated with `messages`; empty if it failed."""
+        # A single oversized message is cut to the batch budget rather than left to Ollama's truncation
+        limit = settings.CONTEXT_SUMMARY_BATCH_TOKENS * 4
+        transcript = "\n".join(f"{m['role']}: {m['content'][:limit]}" for m in messages)
+        prompt = (
+            "Update the running summary of a conversation with the new messages below. "
+            "Keep names, facts and decisions; drop small talk. Answer with the summary only, "
+            "in under 150 words.\n\n"
+            f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+        )
+        text = ""
+        messages = [{"role": "user", "content": prompt}]
+        async for token in llm_service.stream_chat(messages, priority="background", deadline=settings.OLLAMA_BACKGROUND_DEADLINE):
+            text += token
+        text = text.strip()
+        return "" if text.startswith("Error:") else text
+
+context_service = ContextService()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into multi-input calls.
+
+    Requests for the same model are gathered for up to `window` seconds or
+    until `max_size` texts are waiting, then sent as a single batch. If the
+    batch call fails, its texts are retried one by one so a single bad input
+    only fails its own caller.
+    """
+
+    def __init__(self, embed_batch, embed_one, window: float = settings.EMBEDDING_BATCH_WINDOW_MS / 1000, max_size: int = settings.EMBEDDING_BATCH_MAX_SIZE):
+        self._embed_batch = embed_batch
+        self._embed_one = embed_one
+        self.window = window
+        self.max_size = max_size
+        self._pending: dict[str, list[tuple[str, asyncio.Future, float]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.fallbacks = 0
+
+    async def embed(self, model: str, text: str) -> list[float]:
+        """Queue a text for the next batch and wait for its vector."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        items = self._pending.setdefault(model, [])
+        items.append((text, future, time.perf_counter()))
+
+        if len(items) >= self.max_size:
+            self._dispatch(model)
+        elif model not in self._timers:
+            self._timers[model] = loop.call_later(self.window, self._dispatch, model)
+        return await future
+
+    def _dispatch(self, model: str):
+        timer = self._timers.pop(model, None)
+        if timer:
+            timer.cancel()
+        items = self._pending.pop(model, [])
+        if not items:
+            return
+        task = asyncio.create_task(self._run(model, items))
+        # Hold a reference so the task is not garbage collected mid-flight.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model: str, items: list[tuple[str, asyncio.Future, float]]):
+        started = time.perf_counter()
+        for _, _, queued_at in items:
+            wait = started - queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        self.batches += 1
+        self.items += len(items)
+        self.max_batch_size = max(self.max_batch_size, len(items))
+
+        # Identical texts inside one window share a single input slot.
+        texts = list(dict.fromkeys(text for text, _, _ in items))
+        try:
+            vectors = await self._embed_batch(model, texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            logger.warning("Batch embedding failed, retrying items individually: %s", e)
+            self.fallbacks += 1
+            vectors = await asyncio.gather(
+                *(self._embed_one(model, text) for text in texts),
+                return_exceptions=True,
+            )
+
+        results = dict(zip(texts, vectors))
+        for text, future, _ in items:
+            if future.done():
+                continue
+            vector = results.get(text)
+            future.set_result([] if isinstance(vector, BaseException) or vector is None else vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_wait_ms": self.total_wait / self.items * 1000 if self.items else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "fallbacks": self.fallbacks,
+            "pending": sum(len(items) for items in self._pending.values()),
+        }
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import unicodedata
+from array import array
+from collections import OrderedDict
+from app.core.clients import clients
+from app.core.config import settings
+from app.core.metrics import EMBEDDING_CACHE
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Two-tier cache for embeddings keyed by (model, hash of normalized text).
+
+    Tier one is an in-process LRU; tier two is shared in Redis, where vectors
+    are stored as packed float32 bytes with a TTL. The model name is part of
+    every key, so switching the active model never returns a foreign vector.
+    """
+
+    def __init__(self, max_size: int = settings.EMBEDDING_CACHE_SIZE, ttl: int = settings.EMBEDDING_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local: OrderedDict[str, list[float]] = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        # Unicode and whitespace differences should not cost a new embedding.
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def _key(self, model: str, text: str) -> str:
+        digest = hashlib.sha256(self._normalize(text).encode("utf-8")).hexdigest()
+        return f"emb:{model}:{digest}"
+
+    def _remember(self, key: str, vector: list[float]):
+        self._local[key] = vector
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def get(self, model: str, text: str) -> list[float] | None:
+        """Return the cached vector, checking memory first and then Redis."""
+        key = self._key(model, text)
+        vector = self._local.get(key)
+        if vector is not None:
+            self._local.move_to_end(key)
+            self.local_hits += 1
+            EMBEDDING_CACHE.labels("local_hit").inc()
+            return vector
+
+        try:
+            data = await clients.redis_bytes.get(key)
+        except Exception as e:
+            logger.error("Embedding cache lookup failed: %s", e)
+            data = None
+        if data:
+            vector = array("f", data).tolist()
+            self._remember(key, vector)
+            self.redis_hits += 1
+            EMBEDDING_CACHE.labels("redis_hit").inc()
+            return vector
+
+        self.misses += 1
+        EMBEDDING_CACHE.labels("miss").inc()
+        return None
+
+    async def set(self, model: str, text: str, vector: list[float]):
+        """Store a vector in both tiers."""
+        key = self._key(model, text)
+        self._remember(key, vector)
+        try:
+            await clients.redis_bytes.set(key, array("f", vector).tobytes(), ex=self.ttl)
+        except Exception as e:
+            logger.error("Embedding cache store failed: %s", e)
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._local),
+            "max_size": self.max_size,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from app.core.config import settings
+from app.core.metrics import VECTOR_SECONDS
+from app.services.vectors import vector_service
+
+logger = logging.getLogger(__name__)
+
+class FactWriter:
+    """Write-behind queue that upserts long-term memory facts in batches.
+
+    Chat turns and /knowledge/add enqueue facts and return immediately. A
+    background task flushes them to Qdrant when `batch_size` facts are waiting
+    or `flush_interval` seconds have passed. The queue is bounded: once full,
+    `enqueue` waits for room, which pushes back on producers instead of
+    growing memory without limit.
+    """
+
+    def __init__(self, max_size: int = settings.FACT_QUEUE_MAX_SIZE, batch_size: int = settings.FACT_BATCH_SIZE, flush_interval: float = settings.FACT_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.total_flush_time = 0.0
+        self.last_flush_ms = 0.0
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        return self._queue
+
+    async def start(self):
+        """Start the background flusher. Called from the application lifespan."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher once everything queued so far has been written."""
+        if self._task is not None:
+            # The sentinel lands behind every queued fact, so they flush first.
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+
+    async def enqueue(self, text: str, embedding: list[float], model: str, meta: dict | None = None):
+        """Queue a fact embedded by `model` for the next batch, waiting if the queue is full.
+
+        `meta` may carry the session_id, user_id and source the fact belongs to.
+        """
+        await self.queue.put((model, text, embedding, meta or {}))
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[str, str, list[float], dict]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        # Each model's vectors live in their own collection
+        by_model: dict[str, list[tuple[str, list[float], dict]]] = {}
+        for model, text, embedding, meta in batch:
+            by_model.setdefault(model, []).append((text, embedding, meta))
+        for model, facts in by_model.items():
+            try:
+                await vector_service.upsert_facts(facts, model)
+                self.flushed += len(facts)
+            except Exception as e:
+                self.failed += len(facts)
+                logger.error("Failed to flush %s facts to Qdrant: %s", len(facts), e)
+        elapsed = time.perf_counter() - started
+        VECTOR_SECONDS.labels("flush").observe(elapsed)
+        self.flushes += 1
+        self.total_flush_time += elapsed
+        self.last_flush_ms = elapsed * 1000
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize(),
+            "max_size": self.max_size,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "avg_flush_ms": self.total_flush_time / self.flushes * 1000 if self.flushes else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+fact_writer = FactWriter()
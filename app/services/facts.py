@@ -0,0 +1,37 @@
+import hashlib
+import re
+import uuid
+
+def fact_hash(text: str) -> str:
+    """Content hash of a fact, ignoring case and whitespace differences."""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def fact_id(digest: str) -> str:
+    """Deterministic point id, so the same fact always maps to the same point."""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, digest))
+
+def collection_name(prefix: str, model: str, dimension: int) -> str:
+    """Name of the collection holding vectors of `model` with `dimension`."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", model).strip("_").lower()
+    return f"{prefix}_{slug}_{dimension}"
+
+def merge_owners(a: dict, b: dict) -> dict:
+    """Combine the `sessions`/`users` owner lists of two copies of one fact.
+
+    A fact without owners is shared knowledge visible to every scope, so
+    shared wins over owned; otherwise the owner lists are unioned.
+    """
+    if not (a.get("sessions") or a.get("users")) or not (b.get("sessions") or b.get("users")):
+        return {"sessions": [], "users": []}
+    return {
+        "sessions": sorted(set(a.get("sessions", [])) | set(b.get("sessions", []))),
+        "users": sorted(set(a.get("users", [])) | set(b.get("users", []))),
+    }
+
+def fact_owners(meta: dict) -> dict:
+    """Owner lists for a fact written with `meta` (session_id, user_id, source)."""
+    return {
+        "sessions": [meta["session_id"]] if meta.get("session_id") else [],
+        "users": [meta["user_id"]] if meta.get("user_id") else [],
+    }
@@ -0,0 +1,247 @@
+import asyncio
+import codecs
+import json
+import logging
+import re
+import time
+import uuid
+from typing import AsyncIterator
+from app.core.clients import clients
+from app.core.config import settings
+from app.services.llm import llm_service
+from app.services.vectors import fact_hash, vector_service
+
+logger = logging.getLogger(__name__)
+
+# Progress of recent jobs is kept in Redis so any worker can report it
+JOB_TTL = 86400
+
+def chunk_text(text: str, max_chars: int = settings.INGEST_CHUNK_CHARS) -> list[str]:
+    """Split a document into chunks of at most `max_chars`, on paragraph then sentence boundaries."""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            # A single sentence longer than a chunk is hard-wrapped
+            pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def read_document(body: AsyncIterator[bytes], max_chars: int = settings.INGEST_CHUNK_CHARS) -> AsyncIterator[str]:
+    """Chunk a streamed text/markdown document without holding all of it in memory."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for data in body:
+        buffer += decoder.decode(data)
+        if len(buffer) < 4 * max_chars:
+            continue
+        # Only chunk up to the last paragraph break; the tail may continue in the next read
+        cut = buffer.rfind("\n\n")
+        if cut <= 0:
+            cut = len(buffer)
+        for chunk in chunk_text(buffer[:cut], max_chars):
+            yield chunk
+        buffer = buffer[cut:]
+    buffer += decoder.decode(b"", final=True)
+    for chunk in chunk_text(buffer, max_chars):
+        yield chunk
+
+async def read_ndjson(body: AsyncIterator[bytes], max_chars: int = settings.INGEST_CHUNK_CHARS) -> AsyncIterator[str]:
+    """Yield chunks from a stream of JSON lines, each {"text": ...} or a bare string."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+
+    def parse(line: str) -> list[str]:
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning("Skipping malformed NDJSON line: %s", line[:80])
+            return []
+        text = item.get("text", "") if isinstance(item, dict) else str(item)
+        return chunk_text(text, max_chars)
+
+    async for data in body:
+        buffer += decoder.decode(data)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            for chunk in parse(line):
+                yield chunk
+    for chunk in parse(buffer + decoder.decode(b"", final=True)):
+        yield chunk
+
+class IngestJob:
+    """Progress counters for one bulk ingestion."""
+
+    def __init__(self, job_id: str, model: str, meta: dict):
+        self.id = job_id
+        self.model = model
+        self.meta = meta
+        self.status = "receiving"
+        self.received = 0
+        self.skipped = 0
+        self.failed = 0
+        self.stored = 0
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.seen: set[str] = set()
+        self.pending: list[tuple[str, list[float], dict]] = []
+
+    @property
+    def ingested_key(self) -> str:
+        """Redis set of content hashes already ingested for this model and owner scope.
+
+        Keyed by owners so the same document ingested for another session or
+        user is still stored, which adds those owners to the existing facts.
+        """
+        key = f"ingested:{self.model}"
+        if self.meta.get("session_id") or self.meta.get("user_id"):
+            key += f":{self.meta.get('session_id') or ''}:{self.meta.get('user_id') or ''}"
+        return key
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "model": self.model,
+            "source": self.meta.get("source"),
+            "status": self.status,
+            "received": self.received,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "stored": self.stored,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class IngestionService:
+    """Bulk knowledge ingestion: chunk, embed concurrently, upsert in large batches.
+
+    The request body is consumed as a stream into a bounded queue drained by
+    INGEST_CONCURRENCY embedding workers, whose concurrent calls the embedding
+    batcher coalesces. Embedded chunks are upserted INGEST_BATCH_SIZE at a
+    time. Chunks whose content hash was already ingested for the model and
+    the same owners are skipped before embedding.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, IngestJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def ingest(self, chunks: AsyncIterator[str], job_id: str | None = None, meta: dict | None = None) -> IngestJob:
+        """Consume `chunks` into a new job and return it; embedding continues in the background.
+
+        `meta` (source, session_id, user_id) is stored with every chunk.
+        """
+        meta = {"source": "ingest", **(meta or {})}
+        job = IngestJob(job_id or str(uuid.uuid4()), await llm_service.get_active_model(), meta)
+        self.jobs[job.id] = job
+        # Saved up front so every worker can report the job while the body is still arriving
+        await self._save(job)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        workers = [asyncio.create_task(self._worker(job, queue)) for _ in range(settings.INGEST_CONCURRENCY)]
+        interrupted = True
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+                job.received += 1
+                if job.received % settings.INGEST_BATCH_SIZE == 0:
+                    await self._save(job)
+            interrupted = False
+        except Exception as e:
+            # The upload broke off; keep what was received
+            logger.error("Ingestion upload for job %s failed: %s", job.id, e)
+        finally:
+            # Also reached when the client disconnects and the request is cancelled:
+            # the workers are stopped and what arrived is stored by a separate task
+            job.status = "processing"
+            task = asyncio.create_task(self._finish(job, queue, workers, interrupted))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def get_job(self, job_id: str) -> dict | None:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        data = await clients.redis.get(f"ingest_job:{job_id}")
+        return json.loads(data) if data else None
+
+    async def _worker(self, job: IngestJob, queue: asyncio.Queue):
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            # A failing chunk must not stop the worker, or the upload would block on a full queue
+            try:
+                await self._process(job, chunk)
+            except Exception as e:
+                job.failed += 1
+                logger.error("Ingestion job %s failed to embed a chunk: %s", job.id, e)
+
+    async def _process(self, job: IngestJob, chunk: str):
+        digest = fact_hash(chunk)
+        if digest in job.seen or await clients.redis.sismember(job.ingested_key, digest):
+            job.skipped += 1
+            return
+        job.seen.add(digest)
+        embedding = await llm_service.generate_embedding(chunk, job.model)
+        if not embedding:
+            job.failed += 1
+            return
+        job.pending.append((chunk, embedding, job.meta))
+        if len(job.pending) >= settings.INGEST_BATCH_SIZE:
+            await self._flush(job)
+
+    async def _flush(self, job: IngestJob):
+        batch, job.pending = job.pending, []
+        if not batch:
+            return
+        try:
+            await vector_service.upsert_facts(batch, job.model)
+            await clients.redis.sadd(job.ingested_key, *(fact_hash(text) for text, _, _ in batch))
+            job.stored += len(batch)
+        except Exception as e:
+            job.failed += len(batch)
+            logger.error("Ingestion job %s failed to store %s chunks: %s", job.id, len(batch), e)
+        await self._save(job)
+
+    async def _finish(self, job: IngestJob, queue: asyncio.Queue, workers: list[asyncio.Task], interrupted: bool):
+        await self._save(job)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=True)
+        await self._flush(job)
+        # An upload that broke off keeps what was stored but is reported as failed
+        job.status = "failed" if interrupted else "done"
+        job.finished_at = time.time()
+        job.seen.clear()
+        # Finished jobs are served from Redis; one that could not be saved stays in memory
+        if await self._save(job):
+            self.jobs.pop(job.id, None)
+        logger.info("Ingestion job %s done: %s", job.id, job.to_dict())
+
+    async def _save(self, job: IngestJob) -> bool:
+        try:
+            await clients.redis.set(f"ingest_job:{job.id}", json.dumps(job.to_dict()), ex=JOB_TTL)
+            return True
+        except Exception as e:
+            logger.error("Failed to save ingestion job %s: %s", job.id, e)
+            return False
+
+ingestion_service = IngestionService()
@@ -1,97 +1,217 @@
+import asyncio
 import httpx
 import json
-import redis.asyncio as redis
+import logging
+import time
+from app.core.clients import clients
 from app.core.config import settings
+from app.core.metrics import (
+    EMBEDDING_SECONDS, GENERATED_TOKENS, GENERATION_SECONDS, GENERATION_TOKENS_PER_SECOND,
+    MODEL_LOAD_SECONDS, OLLAMA_REQUEST_SECONDS, OLLAMA_TTFT_SECONDS, PROMPT_EVAL_SECONDS, PROMPT_EVAL_TOKENS, timed,
+)
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_cache import embedding_cache
+from app.services.model_manager import model_manager
+from app.services.scheduler import Overloaded
+
+logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
-        self.ollama_url = settings.OLLAMA_URL
-        self.redis_url = settings.REDIS_URL
+        self.embedding_batcher = EmbeddingBatcher(self._request_embedding_batch, self._request_embedding)
+        # Process-local copy of llm:active_model, kept fresh by pub/sub with a TTL fallback
+        self._active_model: str | None = None
+        self._active_model_expires = 0.0
+        self._listener: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
 
     async def _get_redis(self):
-        return redis.from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        return clients.redis
 
     async def get_active_model(self) -> str:
-        """Get the currently active model from Redis, or default."""
+        """Get the currently active model, from the local cache or Redis, or default."""
+        if self._active_model is not None and time.monotonic() < self._active_model_expires:
+            return self._active_model
         r = await self._get_redis()
         model = await r.get("llm:active_model")
-        await r.close()
-        return model if model else settings.DEFAULT_MODEL
+        self._cache_active_model(model if model else settings.DEFAULT_MODEL)
+        return self._active_model
+
+    def _cache_active_model(self, model_name: str | None):
+        self._active_model = model_name
+        self._active_model_expires = time.monotonic() + settings.ACTIVE_MODEL_CACHE_TTL
 
     async def set_active_model(self, model_name: str):
-        """Set the active model in Redis."""
+        """Set the active model in Redis and tell every worker about it."""
         r = await self._get_redis()
-        await r.set("llm:active_model", model_name)
-        await r.close()
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.set("llm:active_model", model_name)
+            pipe.publish("llm:active_model", model_name)
+            await pipe.execute()
+        self._cache_active_model(model_name)
+        # Load the new model now rather than on the first chat that needs it
+        task = asyncio.create_task(model_manager.warm(model_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def prepare_models(self):
+        """Pull the default model, then load the active one on every host. Run in the background at startup."""
+        await self.pull_model(settings.DEFAULT_MODEL)
+        await model_manager.refresh()
+        await model_manager.warm(await self.get_active_model())
+
+    async def start_model_listener(self):
+        """Subscribe to active model changes. Called from the application lifespan."""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen_for_model_changes())
+
+    async def stop_model_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen_for_model_changes(self):
+        while True:
+            pubsub = clients.redis.pubsub()
+            try:
+                await pubsub.subscribe("llm:active_model")
+                while True:
+                    # Pooled connections time out reads after REDIS_SOCKET_TIMEOUT, so poll
+                    # within it: a quiet channel is the normal case, not a failure
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=settings.REDIS_SOCKET_TIMEOUT / 2
+                    )
+                    if message is not None and message["type"] == "message":
+                        self._cache_active_model(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Active model listener failed, retrying: %s", e)
+                # Notifications may have been missed while disconnected
+                self._cache_active_model(None)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
 
     async def pull_model(self, model_name: str):
-        """Trigger a model pull request to Ollama."""
-        async with httpx.AsyncClient(timeout=None) as client:
-            # We use stream=True to not block forever, but here we just trigger it
-            # In a real world scenario we might want to stream the progress back
-            async with client.stream("POST", f"{self.ollama_url}/api/pull", json={"name": model_name}) as response:
-                async for line in response.aiter_lines():
-                    # We iterate to keep the connection alive until done, or valid JSON
-                    pass
+        """Trigger a model pull request on every Ollama host."""
+        await asyncio.gather(*(self._pull_model(host.url, model_name) for host in model_manager.hosts))
         return True
 
+    async def _pull_model(self, url: str, model_name: str):
+        client = clients.http
+        # We use stream=True to not block forever, but here we just trigger it
+        # In a real world scenario we might want to stream the progress back
+        async with client.stream("POST", f"{url}/api/pull", json={"name": model_name}) as response:
+            async for line in response.aiter_lines():
+                # We iterate to keep the connection alive until done, or valid JSON
+                pass
+
     async def delete_model(self, model_name: str):
-        """Delete a model from Ollama."""
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{self.ollama_url}/api/delete",
-                json={"name": model_name}
+        """Delete a model from every Ollama host."""
+        responses = await asyncio.gather(*(
+            clients.http.request(
+                "DELETE", f"{host.url}/api/delete", json={"name": model_name}, timeout=settings.HTTP_READ_TIMEOUT
             )
-            return response.status_code == 200
+            for host in model_manager.hosts
+        ), return_exceptions=True)
+        # A host that timed out or could not be reached counts as a failed delete
+        return all(isinstance(response, httpx.Response) and response.status_code == 200 for response in responses)
 
-    async def generate_embedding(self, text: str) -> list[float]:
+    async def generate_embedding(self, text: str, model: str | None = None) -> list[float]:
+        """Get vector embedding for text, served from the cache when possible.
+
+        Uses the active model unless `model` is given; callers that also store
+        or search the vector pass the same model to VectorService.
+        """
+        started = time.perf_counter()
+        active_model = model or await self.get_active_model()
+        if settings.EMBEDDING_CACHE_ENABLED:
+            cached = await embedding_cache.get(active_model, text)
+            if cached is not None:
+                EMBEDDING_SECONDS.labels("cache").observe(time.perf_counter() - started)
+                return cached
+
+        if settings.EMBEDDING_BATCH_ENABLED:
+            embedding = await self.embedding_batcher.embed(active_model, text)
+        else:
+            embedding = await self._request_embedding(active_model, text)
+        if embedding and settings.EMBEDDING_CACHE_ENABLED:
+            await embedding_cache.set(active_model, text, embedding)
+        EMBEDDING_SECONDS.labels("ollama").observe(time.perf_counter() - started)
+        return embedding
+
+    @timed(OLLAMA_REQUEST_SECONDS, "embeddings")
+    async def _request_embedding(self, active_model: str, text: str) -> list[float]:
         """Get vector embedding for text using Ollama."""
-        active_model = await self.get_active_model()
-        print(f"DEBUG: Generating embedding for text: {text[:50]}... using {active_model}")
-        async with httpx.AsyncClient() as client:
-            try:
-                print("DEBUG: Sending embedding request to Ollama...")
-                response = await client.post(
-                    f"{self.ollama_url}/api/embeddings",
-                    json={"model": active_model, "prompt": text},
+        logger.debug("Generating embedding for text: %s... using %s", text[:50], active_model)
+        try:
+            logger.debug("Sending embedding request to Ollama...")
+            host = model_manager.pick(active_model)
+            async with host.scheduler.slot("embedding"):
+                response = await clients.http.post(
+                    f"{host.url}/api/embeddings",
+                    json={"model": active_model, "prompt": text, **model_manager.request_options()},
                     timeout=None # Allow time for model loading
                 )
-                print(f"DEBUG: Embedding response status: {response.status_code}")
-                if response.status_code != 200:
-                    print(f"Embedding failed: {response.text}")
-                    return []
-                return response.json().get("embedding", [])
-            except (httpx.ConnectError, httpx.ReadTimeout) as e:
-                print(f"Embedding connection error: {e}")
+            logger.debug("Embedding response status: %s", response.status_code)
+            if response.status_code != 200:
+                logger.warning("Embedding failed: %s", response.text)
                 return []
+            model_manager.mark_resident(host, active_model)
+            return response.json().get("embedding", [])
+        except (httpx.ConnectError, httpx.ReadTimeout) as e:
+            logger.warning("Embedding connection error: %s", e)
+            return []
+        except Overloaded as e:
+            logger.warning("Embedding request dropped: %s", e)
+            return []
 
-    async def stream_chat(self, messages: list, context_text: str = ""):
-        """Stream chat response from Ollama."""
+    @timed(OLLAMA_REQUEST_SECONDS, "embed")
+    async def _request_embedding_batch(self, active_model: str, texts: list[str]) -> list[list[float]]:
+        """Embed several texts in one call to Ollama's batch endpoint."""
+        logger.debug("Sending batch of %s embedding inputs using %s", len(texts), active_model)
+        host = model_manager.pick(active_model)
+        async with host.scheduler.slot("embedding"):
+            response = await clients.http.post(
+                f"{host.url}/api/embed",
+                json={"model": active_model, "input": texts, **model_manager.request_options()},
+                timeout=None # Allow time for model loading
+            )
+        response.raise_for_status()
+        model_manager.mark_resident(host, active_model)
+        return response.json().get("embeddings", [])
+
+    async def stream_chat(self, messages: list, context_text: str = "", priority: str = "chat", deadline: float | None = None):
+        """Stream chat response from Ollama.
+
+        `priority` is the scheduler class: "chat" for users waiting on the
+        answer, "background" for titles and summaries, which pass a
+        `deadline` so they are dropped rather than run late.
+        """
         active_model = await self.get_active_model()
-        print(f"DEBUG: Starting stream_chat with {active_model}...")
-        
-        system_prompt = (
-            "You are Local-Mind, a helpful AI assistant. "
-            "You have access to the following memory context. "
-            "ALWAYS use this context to answer questions about the user or past conversations. "
-            "If the answer is in the context, repeat it accurately."
-        )
-        if context_text:
-            system_prompt += f"\n\n=== MEMORY CONTEXT ===\n{context_text}\n======================"
+        logger.debug("Starting stream_chat with %s...", active_model)
         
-        # Prepend system message
-        messages_with_system = [{"role": "system", "content": system_prompt}] + messages
+        messages_with_system = self._assemble_prompt(messages, context_text)
 
-        async with httpx.AsyncClient() as client:
-            try:
-                print("DEBUG: Connecting to Ollama chat endpoint...")
-                async with client.stream(
+        try:
+            host = model_manager.pick(active_model)
+            async with host.scheduler.slot(priority, deadline):
+                logger.debug("Connecting to Ollama chat endpoint at %s...", host.url)
+                started = time.perf_counter()
+                first_token_at = None
+                chunks = 0
+                async with clients.http.stream(
                     "POST",
-                    f"{self.ollama_url}/api/chat",
-                    json={"model": active_model, "messages": messages_with_system},
+                    f"{host.url}/api/chat",
+                    json={"model": active_model, "messages": messages_with_system, **model_manager.request_options()},
                     timeout=None
                 ) as response:
-                    print(f"DEBUG: Chat response status: {response.status_code}")
+                    logger.debug("Chat response status: %s", response.status_code)
                     if response.status_code == 404:
                          yield f"Error: Model '{active_model}' not found. Please pull it first."
                          return
@@ -104,12 +224,61 @@ class LLMService:
                             try:
                                 json_response = json.loads(line)
                                 if "message" in json_response:
+                                    if first_token_at is None:
+                                        first_token_at = time.perf_counter()
+                                        OLLAMA_TTFT_SECONDS.observe(first_token_at - started)
+                                    chunks += 1
                                     yield json_response["message"]["content"]
                                 if json_response.get("done"):
+                                    self._record_generation(started, first_token_at, json_response.get("eval_count", chunks))
+                                    PROMPT_EVAL_SECONDS.labels(settings.PROMPT_LAYOUT).observe(json_response.get("prompt_eval_duration", 0) / 1e9)
+                                    PROMPT_EVAL_TOKENS.labels(settings.PROMPT_LAYOUT).inc(json_response.get("prompt_eval_count", 0))
+                                    # Ollama reports how long it spent loading the model, in nanoseconds
+                                    MODEL_LOAD_SECONDS.labels("chat").observe(json_response.get("load_duration", 0) / 1e9)
+                                    model_manager.mark_resident(host, active_model)
                                     break
                             except json.JSONDecodeError:
                                 continue
-            except httpx.ConnectError:
-                yield "Error: Could not connect to Ollama. Is the container running?"
+        except httpx.ConnectError:
+            yield "Error: Could not connect to Ollama. Is the container running?"
+        except Overloaded as e:
+            logger.warning("Chat request dropped: %s", e)
+            yield "Error: The model is busy right now. Please try again in a moment."
+
+    @staticmethod
+    def _assemble_prompt(messages: list, context_text: str) -> list:
+        """Prepend the system prompt and place the memory context according to PROMPT_LAYOUT.
+
+        "system" puts the context in the system prompt. "prefix_stable" keeps
+        the system prompt and earlier turns byte-identical from turn to turn,
+        so Ollama can reuse its KV cache for them, and puts the context in
+        front of the newest user message instead.
+        """
+        system_prompt = (
+            "You are Local-Mind, a helpful AI assistant. "
+            "You have access to the following memory context. "
+            "ALWAYS use this context to answer questions about the user or past conversations. "
+            "If the answer is in the context, repeat it accurately."
+        )
+        if not context_text:
+            return [{"role": "system", "content": system_prompt}] + messages
+
+        block = f"=== MEMORY CONTEXT ===\n{context_text}\n======================"
+        if settings.PROMPT_LAYOUT == "prefix_stable" and messages and messages[-1]["role"] == "user":
+            latest = messages[-1]
+            return (
+                [{"role": "system", "content": system_prompt}]
+                + messages[:-1]
+                + [{"role": "user", "content": f"{block}\n\n{latest['content']}"}]
+            )
+        return [{"role": "system", "content": f"{system_prompt}\n\n{block}"}] + messages
+
+    @staticmethod
+    def _record_generation(started: float, first_token_at: float | None, tokens: int):
+        finished = time.perf_counter()
+        GENERATION_SECONDS.observe(finished - started)
+        GENERATED_TOKENS.inc(tokens)
+        if first_token_at is not None and finished > first_token_at:
+            GENERATION_TOKENS_PER_SECOND.observe(tokens / (finished - first_token_at))
 
 llm_service = LLMService()
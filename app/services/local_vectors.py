@@ -0,0 +1,310 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import numpy as np
+from app.core.config import settings
+from app.core.metrics import VECTOR_SECONDS, timed
+from app.services.facts import collection_name, fact_hash, fact_id, fact_owners, merge_owners
+
+class LocalCollection:
+    """Vectors of one model in a memory-mapped float32 matrix, plus their payloads.
+
+    Rows are L2-normalized on insert so cosine search is a single matrix-vector
+    product. The matrix file grows by doubling and is appended to in place;
+    payloads and hit-count updates go to an append-only JSON-lines log that is
+    replayed on load. The fields searches filter on are also kept as columns
+    (last_seen, whether the fact is shared, and the rows of every session and
+    user) so scopes are applied as NumPy masks rather than per-payload checks.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        self.dimension = dimension
+        self.vectors_path = f"{path}.f32"
+        self.payloads_path = f"{path}.jsonl"
+        self.count = 0
+        self.ids: list[str] = []
+        self.payloads: list[dict] = []
+        self.rows: dict[str, int] = {}
+        self._matrix: np.memmap | None = None
+        self._last_seen = np.zeros(0, dtype=np.int64)
+        self._shared = np.zeros(0, dtype=bool)
+        self._owned: dict[str, set[int]] = {}
+        # Log records of the current batch, written to disk in one go by persist()
+        self._unlogged: list[str] = []
+        self._log_lock = asyncio.Lock()
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.payloads_path):
+            with open(self.payloads_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write at the tail of the log; everything before it is intact
+                        break
+                    if "set" in record:
+                        self.payloads[self.rows[record["id"]]].update(record["set"])
+                    else:
+                        self.rows[record["id"]] = len(self.payloads)
+                        self.ids.append(record["id"])
+                        self.payloads.append(record["payload"])
+        self.count = len(self.payloads)
+
+        capacity = 0
+        if os.path.exists(self.vectors_path):
+            capacity = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        self._map(max(capacity, self.count, 1024))
+        for row, payload in enumerate(self.payloads):
+            self._index(row, payload)
+
+    def _index(self, row: int, payload: dict):
+        """Update the filter columns of `row` from its payload."""
+        self._last_seen[row] = payload.get("last_seen", 0)
+        self._shared[row] = not (payload.get("sessions") or payload.get("users"))
+        for key in self._owner_keys(payload):
+            self._owned.setdefault(key, set()).add(row)
+
+    @staticmethod
+    def _owner_keys(payload: dict) -> list[str]:
+        return [f"session:{s}" for s in payload.get("sessions", [])] + [f"user:{u}" for u in payload.get("users", [])]
+
+    def _owner_mask(self, key: str) -> np.ndarray:
+        mask = np.zeros(self.count, dtype=bool)
+        rows = self._owned.get(key)
+        if rows:
+            mask[np.fromiter(rows, dtype=np.intp, count=len(rows))] = True
+        return mask
+
+    def mask(self, session_id: str | None = None, user_id: str | None = None, since: int | None = None, include_shared: bool = True) -> np.ndarray | None:
+        """Rows that pass `scope_filter` with the same arguments, or None when every row does."""
+        allowed = None
+        if session_id or user_id:
+            allowed = np.ones(self.count, dtype=bool)
+            if session_id:
+                allowed &= self._owner_mask(f"session:{session_id}")
+            if user_id:
+                allowed &= self._owner_mask(f"user:{user_id}")
+            if include_shared:
+                allowed |= self._shared[:self.count]
+        if since is not None:
+            recent = self._last_seen[:self.count] >= since
+            allowed = recent if allowed is None else allowed & recent
+        return allowed
+
+    def same_scope(self, owners: dict) -> np.ndarray:
+        """Rows with the same visibility as a fact with `owners`, mirroring VectorService dedup."""
+        if not (owners["sessions"] or owners["users"]):
+            return self._shared[:self.count].copy()
+        session_id = owners["sessions"][0] if owners["sessions"] else None
+        user_id = owners["users"][0] if owners["users"] else None
+        return self.mask(session_id, user_id, include_shared=False)
+
+    def _map(self, capacity: int):
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        grow = capacity - len(self._last_seen)
+        if grow > 0:
+            self._last_seen = np.concatenate([self._last_seen, np.zeros(grow, dtype=np.int64)])
+            self._shared = np.concatenate([self._shared, np.zeros(grow, dtype=bool)])
+
+    def _log(self, record: dict):
+        self._unlogged.append(json.dumps(record))
+
+    def _write_log(self, records: list[str]):
+        with open(self.payloads_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(records) + "\n")
+
+    async def persist(self):
+        """Append the batch's log records to disk in one write, off the event loop."""
+        # Held across the write so batches reach the log in the order they were made
+        async with self._log_lock:
+            records, self._unlogged = self._unlogged, []
+            if records:
+                await asyncio.to_thread(self._write_log, records)
+
+    def search(self, vector: list[float], limit: int, threshold: float | None = None, allowed: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """Top-k rows by cosine similarity, best first, among the rows set in the `allowed` mask."""
+        if self.count == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self._matrix[:self.count] @ (query / norm)
+        if allowed is not None:
+            scores = np.where(allowed, scores, -np.inf)
+            limit = min(limit, int(allowed.sum()))
+            if limit == 0:
+                return []
+        k = min(limit, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if threshold is None or scores[row] >= threshold]
+
+    def append(self, point_id: str, vector: list[float], payload: dict):
+        if self.count == len(self._matrix):
+            self._map(len(self._matrix) * 2)
+        row = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(row)
+        self._matrix[self.count] = row / norm if norm else row
+        # The vector is written before its log record, so a crash before the
+        # record is persisted leaves an unreferenced row that the next append overwrites.
+        self._log({"id": point_id, "payload": payload})
+        self.rows[point_id] = self.count
+        self.ids.append(point_id)
+        self.payloads.append(payload)
+        self._index(self.count, payload)
+        self.count += 1
+
+    def update(self, row: int, changes: dict):
+        # Merging can turn an owned fact into a shared one, so drop its old owners first
+        for key in self._owner_keys(self.payloads[row]):
+            self._owned[key].discard(row)
+        self.payloads[row].update(changes)
+        self._index(row, self.payloads[row])
+        self._log({"id": self.ids[row], "set": changes})
+
+    def flush(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+
+class LocalVectorService:
+    """In-process alternative to VectorService for single-node deployments and tests.
+
+    Same interface as the Qdrant-backed service: one collection per embedding
+    model and dimension, hash and similarity dedup on write, and top-k cosine
+    search, all without a network round trip.
+
+    The index files can only be used by one process: an exclusive lock on
+    LOCAL_INDEX_PATH makes any other worker refuse to open it, so run a
+    single uvicorn worker with VECTOR_BACKEND=local.
+    """
+
+    def __init__(self):
+        self.path = settings.LOCAL_INDEX_PATH
+        self.collection_name = settings.QDRANT_COLLECTION_PREFIX
+        self._collections: dict[str, LocalCollection] = {}
+        self.dimensions: dict[str, int] = {}
+        self._lock_file = None
+
+    def _lock_index(self):
+        if self._lock_file is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(os.path.join(self.path, ".lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(
+                f"The local vector index in {self.path} is open in another process; "
+                "VECTOR_BACKEND=local supports a single worker"
+            ) from None
+        self._lock_file = lock_file
+
+    async def setup(self):
+        """Load every persisted collection. Called from the application lifespan."""
+        self._lock_index()
+        for filename in os.listdir(self.path):
+            if filename.endswith(".jsonl"):
+                name = filename[:-len(".jsonl")]
+                if name in self._collections:
+                    continue
+                dimension = int(name.rsplit("_", 1)[1])
+                self._collections[name] = LocalCollection(os.path.join(self.path, name), dimension)
+                # The name only holds a slug of the model; its real name is kept beside it
+                model_path = os.path.join(self.path, f"{name}.model")
+                if os.path.exists(model_path):
+                    with open(model_path, encoding="utf-8") as f:
+                        self.dimensions[f.read().strip()] = dimension
+
+    def collection_for(self, model: str, dimension: int) -> str:
+        return collection_name(self.collection_name, model, dimension)
+
+    def collections(self) -> list[str]:
+        return sorted(self._collections)
+
+    def _collection(self, model: str, dimension: int, create: bool) -> LocalCollection | None:
+        self._lock_index()
+        name = self.collection_for(model, dimension)
+        if name not in self._collections and create:
+            path = os.path.join(self.path, name)
+            self._collections[name] = LocalCollection(path, dimension)
+            with open(f"{path}.model", "w", encoding="utf-8") as f:
+                f.write(model)
+        if name in self._collections:
+            self.dimensions[model] = dimension
+        return self._collections.get(name)
+
+    async def upsert_fact(self, text: str, embedding: list[float], model: str, meta: dict | None = None):
+        """Save a fact with its vector embedding."""
+        await self.upsert_facts([(text, embedding, meta or {})], model)
+
+    @timed(VECTOR_SECONDS, "upsert")
+    async def upsert_facts(self, facts: list[tuple[str, list[float], dict]], model: str):
+        """Save several facts embedded by `model`, folding duplicates like VectorService."""
+        if not facts:
+            return
+        collection = self._collection(model, len(facts[0][1]), create=True)
+        now = int(time.time())
+        for text, embedding, meta in facts:
+            digest = fact_hash(text)
+            owners = fact_owners(meta)
+            # The same content always folds into its point, like an upsert on the same id
+            row = collection.rows.get(fact_id(digest))
+            if row is None and settings.FACT_DEDUP_ENABLED:
+                nearest = collection.search(embedding, 1, settings.FACT_DEDUP_THRESHOLD, collection.same_scope(owners))
+                row = nearest[0][0] if nearest else None
+            if row is not None:
+                payload = collection.payloads[row]
+                collection.update(row, {"hits": payload.get("hits", 1) + 1, "last_seen": now, **merge_owners(payload, owners)})
+                continue
+            collection.append(fact_id(digest), embedding, {
+                "text": text,
+                "hash": digest,
+                "hits": 1,
+                **owners,
+                "source": meta.get("source", "chat"),
+                "first_seen": now,
+                "last_seen": now,
+            })
+        await collection.persist()
+
+    @timed(VECTOR_SECONDS, "search")
+    async def search_relevant(
+        self,
+        query_vector: list[float],
+        model: str,
+        limit: int = 3,
+        session_id: str | None = None,
+        user_id: str | None = None,
+        since: int | None = None,
+        include_shared: bool = True,
+        score_threshold: float | None = None,
+    ):
+        """Find facts similar to the query vector, among those embedded by `model` and in scope."""
+        collection = self._collection(model, len(query_vector), create=False)
+        if collection is None:
+            return []
+        allowed = collection.mask(session_id, user_id, since, include_shared)
+        hits = collection.search(query_vector, limit, score_threshold, allowed)
+        return [collection.payloads[row]["text"] for row, _ in hits]
+
+    async def ping(self):
+        """Raise if this process cannot hold the index, e.g. because another worker has it."""
+        self._lock_index()
+
+    async def close(self):
+        for collection in self._collections.values():
+            await collection.persist()
+            collection.flush()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
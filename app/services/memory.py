@@ -1,78 +1,354 @@
-import redis.asyncio as redis
+import asyncio
 import json
+import logging
+import math
 import uuid
 import time
+from redis.exceptions import WatchError
+from app.core.clients import clients
 from app.core.config import settings
+from app.core.metrics import REDIS_SECONDS, SESSION_TIER_MOVES, timed
+from app.services.session_archive import session_archive
+
+logger = logging.getLogger(__name__)
+
+# Sorted sets of session ids, scored by creation and by last-activity time
+SESSIONS_BY_CREATED = "sessions:created"
+SESSIONS_BY_ACTIVITY = "sessions:activity"
+# Sessions whose messages are in the hot tier (a Redis list), by last activity
+SESSIONS_HOT = "sessions:hot"
+ARCHIVE_LOCK = "sessions:archive_lock"
+# Set once the indexes above have been backfilled from sessions that predate them
+SESSIONS_BACKFILLED = "sessions:backfilled"
+
+# Appends a message unless the session sits in the archive, in which case it
+# returns -1 so the caller rehydrates it first. A list left with a TTL by
+# older versions is made persistent; idle lists are archived, not expired.
+ADD_MESSAGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 and tonumber(redis.call('GET', KEYS[2]) or '0') > 0 then
+    return -1
+end
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('PERSIST', KEYS[1])
+redis.call('ZADD', KEYS[3], 'XX', ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[4], ARGV[2], ARGV[3])
+return length
+"""
+
+# Restores archived messages into an empty list; a no-op if another worker got there first.
+REHYDRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+return #ARGV - 2
+"""
+
+class InvalidCursor(ValueError):
+    """A session list cursor that could not be parsed."""
 
 class MemoryService:
+    """Chat history in two tiers.
+
+    Active sessions keep their messages in a Redis list. A background pass
+    moves sessions that have been idle for SESSION_IDLE_SECONDS, or that
+    fall outside the SESSION_HOT_LIMIT most recently active, into the
+    compressed session archive and drops their list. `session_archived:{id}`
+    counts the messages the archive holds; archiving again only appends the
+    messages added since. Reading or writing an archived session restores
+    its list first, so callers never see the difference.
+    """
+
     def __init__(self):
-        self.redis_url = settings.REDIS_URL
+        self._add_script = None
+        self._rehydrate_script = None
+        self._archiver: asyncio.Task | None = None
+        self.archived = 0
+        self.rehydrated = 0
 
     async def _get_connection(self):
-        return redis.from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        return clients.redis
+
+    async def _rehydrate(self, session_id: str) -> bool:
+        """Restore an archived session's list. Returns False if there was nothing to restore."""
+        r = await self._get_connection()
+        messages = await session_archive.load(session_id)
+        if not messages:
+            return False
+        if self._rehydrate_script is None:
+            self._rehydrate_script = r.register_script(REHYDRATE_SCRIPT)
+        restored = await self._rehydrate_script(
+            keys=[f"session:{session_id}", SESSIONS_HOT],
+            args=[time.time(), session_id, *messages],
+        )
+        if restored:
+            self.rehydrated += 1
+            SESSION_TIER_MOVES.labels("rehydrated").inc()
+            logger.debug("Rehydrated %s messages of session %s", restored, session_id)
+        return True
 
-    async def add_message(self, session_id: str, role: str, content: str):
-        """Append a message to the session's list."""
+    @timed(REDIS_SECONDS, "add_message")
+    async def add_message(self, session_id: str, role: str, content: str) -> int:
+        """Append a message to the session's list and return the new length."""
         r = await self._get_connection()
         message = {"role": role, "content": content}
+        if self._add_script is None:
+            self._add_script = r.register_script(ADD_MESSAGE_SCRIPT)
         try:
-            # Push to the list (Right Push)
-            await r.rpush(f"session:{session_id}", json.dumps(message))
-            # Set expiry for 24 hours so we don't leak memory forever
-            await r.expire(f"session:{session_id}", 86400)
+            # Only sessions created through create_session are in the activity index
+            keys = [f"session:{session_id}", f"session_archived:{session_id}", SESSIONS_BY_ACTIVITY, SESSIONS_HOT]
+            args = [json.dumps(message), time.time(), session_id]
+            length = await self._add_script(keys=keys, args=args)
+            if length == -1 and await self._rehydrate(session_id):
+                length = await self._add_script(keys=keys, args=args)
+            return length
         except Exception as e:
-            print(f"ERROR: Failed to add message to Redis: {e}", flush=True)
-        finally:
-            await r.close()
+            logger.error("Failed to add message to Redis: %s", e)
+            return 0
 
+    @timed(REDIS_SECONDS, "get_history")
     async def get_history(self, session_id: str):
         """Retrieve the full chat history for context."""
         r = await self._get_connection()
         try:
-            messages = await r.lrange(f"session:{session_id}", 0, -1)
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.lrange(f"session:{session_id}", 0, -1)
+                pipe.get(f"session_archived:{session_id}")
+                messages, archived = await pipe.execute()
+            if not messages and archived and await self._rehydrate(session_id):
+                messages = await r.lrange(f"session:{session_id}", 0, -1)
             return [json.loads(m) for m in messages]
         except Exception as e:
-            print(f"ERROR: Failed to get history from Redis: {e}", flush=True)
+            logger.error("Failed to get history from Redis: %s", e)
             return []
-        finally:
-            await r.close()
 
+    @timed(REDIS_SECONDS, "get_recent_history")
+    async def get_recent_history(self, session_id: str, count: int):
+        """Fetch the last `count` messages, the total length and the rolling summary."""
+        r = await self._get_connection()
+        try:
+            for attempt in range(2):
+                async with r.pipeline(transaction=False) as pipe:
+                    pipe.lrange(f"session:{session_id}", -count, -1)
+                    pipe.llen(f"session:{session_id}")
+                    pipe.get(f"session_summary:{session_id}")
+                    pipe.get(f"session_archived:{session_id}")
+                    messages, total, summary, archived = await pipe.execute()
+                # An archived session is restored and read again
+                if total or not archived or attempt or not await self._rehydrate(session_id):
+                    break
+            return [json.loads(m) for m in messages], total, json.loads(summary) if summary else None
+        except Exception as e:
+            logger.error("Failed to get recent history from Redis: %s", e)
+            return [], 0, None
+
+    @timed(REDIS_SECONDS, "get_history_range")
+    async def get_history_range(self, session_id: str, start: int, end: int):
+        """Fetch messages by index, inclusive of both ends."""
+        r = await self._get_connection()
+        messages = await r.lrange(f"session:{session_id}", start, end)
+        return [json.loads(m) for m in messages]
+
+    @timed(REDIS_SECONDS, "set_summary")
+    async def set_summary(self, session_id: str, summary: str, upto: int):
+        """Store the rolling summary covering messages [0, upto)."""
+        r = await self._get_connection()
+        data = json.dumps({"summary": summary, "upto": upto})
+        await r.set(f"session_summary:{session_id}", data)
+
+    @timed(REDIS_SECONDS, "delete_history")
     async def delete_history(self, session_id: str):
         """Clear the history for a specific session."""
         r = await self._get_connection()
-        await r.delete(f"session:{session_id}")
-        await r.delete(f"session_meta:{session_id}")
-        await r.close()
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.delete(
+                f"session:{session_id}",
+                f"session_meta:{session_id}",
+                f"session_summary:{session_id}",
+                f"session_archived:{session_id}",
+            )
+            pipe.zrem(SESSIONS_BY_CREATED, session_id)
+            pipe.zrem(SESSIONS_BY_ACTIVITY, session_id)
+            pipe.zrem(SESSIONS_HOT, session_id)
+            await pipe.execute()
+        await session_archive.delete(session_id)
 
+    @timed(REDIS_SECONDS, "create_session")
     async def create_session(self, title: str = "New Chat"):
         """Create a new session with metadata."""
         session_id = str(uuid.uuid4())
         r = await self._get_connection()
+        now = time.time()
         meta = {
             "id": session_id,
             "title": title,
-            "created_at": int(time.time())
+            "created_at": int(now)
         }
-        await r.set(f"session_meta:{session_id}", json.dumps(meta))
-        await r.close()
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.set(f"session_meta:{session_id}", json.dumps(meta))
+            pipe.zadd(SESSIONS_BY_CREATED, {session_id: now})
+            pipe.zadd(SESSIONS_BY_ACTIVITY, {session_id: now})
+            await pipe.execute()
         return meta
 
-    async def list_sessions(self):
-        """List all available sessions sorted by creation time."""
+    @timed(REDIS_SECONDS, "list_sessions")
+    async def list_sessions(self, limit: int = 50, cursor: str | None = None, order: str = "created"):
+        """List one page of sessions, newest first.
+
+        Returns the sessions and the cursor for the next page (None on the last
+        page). `order` is "created" or "activity". Raises InvalidCursor
+        for a cursor that was not returned by this method.
+        """
         r = await self._get_connection()
-        keys = await r.keys("session_meta:*")
-        sessions = []
-        if keys:
-            # redis.keys returns a list of keys, using mget to fetch all at once is efficient
-            values = await r.mget(keys)
-            for v in values:
-                if v:
-                    sessions.append(json.loads(v))
-        await r.close()
-        # Sort by created_at descending (newest first)
-        sessions.sort(key=lambda x: x.get("created_at", 0), reverse=True)
-        return sessions
+        index = SESSIONS_BY_ACTIVITY if order == "activity" else SESSIONS_BY_CREATED
+        if cursor is None:
+            entries = await r.zrevrangebyscore(index, "+inf", "-inf", start=0, num=limit, withscores=True)
+        else:
+            # The cursor is the score and id of the last session on the previous page.
+            # Sessions sharing that score come back in descending id order, so the
+            # ones with a larger id were already sent.
+            score, last_id = self._parse_cursor(cursor)
+            ties = await r.zcount(index, score, score)
+            entries = await r.zrevrangebyscore(index, score, "-inf", start=0, num=limit + ties, withscores=True)
+            entries = [(session_id, s) for session_id, s in entries if s != score or session_id < last_id][:limit]
+        if not entries:
+            return [], None
+
+        values = await r.mget([f"session_meta:{session_id}" for session_id, _ in entries])
+        sessions = [json.loads(v) for v in values if v]
+        next_cursor = f"{entries[-1][1]!r}:{entries[-1][0]}" if len(entries) == limit else None
+        return sessions, next_cursor
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> tuple[float, str]:
+        score, _, last_id = cursor.partition(":")
+        try:
+            value = float(score)
+        except ValueError:
+            value = math.nan
+        if not math.isfinite(value) or not last_id:
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+        return value, last_id
+
+    @timed(REDIS_SECONDS, "archive_session")
+    async def archive_session(self, session_id: str) -> bool:
+        """Move a session's messages to the archive and drop its list.
+
+        Gives up (returning False) if a message is added meanwhile; the
+        segment already written is rewritten by the next attempt.
+        """
+        r = await self._get_connection()
+        key = f"session:{session_id}"
+        archived_key = f"session_archived:{session_id}"
+        async with r.pipeline(transaction=True) as pipe:
+            await pipe.watch(key, archived_key)
+            messages = await pipe.lrange(key, 0, -1)
+            archived = int(await pipe.get(archived_key) or 0)
+            if not messages:
+                await pipe.unwatch()
+                await r.zrem(SESSIONS_HOT, session_id)
+                return False
+            if len(messages) > archived:
+                await session_archive.append(session_id, archived, messages[archived:])
+            pipe.multi()
+            pipe.delete(key)
+            pipe.set(archived_key, len(messages))
+            pipe.zrem(SESSIONS_HOT, session_id)
+            try:
+                await pipe.execute()
+            except WatchError:
+                return False
+        self.archived += 1
+        SESSION_TIER_MOVES.labels("archived").inc()
+        return True
+
+    async def archive_idle_sessions(self, batch: int = 500) -> int:
+        """Archive idle sessions and those beyond SESSION_HOT_LIMIT, oldest activity first."""
+        r = await self._get_connection()
+        cutoff = time.time() - settings.SESSION_IDLE_SECONDS
+        idle = await r.zrangebyscore(SESSIONS_HOT, "-inf", cutoff, start=0, num=batch)
+        excess = await r.zrange(SESSIONS_HOT, 0, -(settings.SESSION_HOT_LIMIT + 1))
+        count = 0
+        for session_id in list(dict.fromkeys(idle + excess))[:batch]:
+            try:
+                count += await self.archive_session(session_id)
+            except Exception as e:
+                logger.error("Failed to archive session %s: %s", session_id, e)
+        if count:
+            logger.info("Archived %s sessions", count)
+        return count
+
+    async def start_archiver(self):
+        """Start the periodic archive pass. Called from the application lifespan."""
+        if self._archiver is None:
+            self._archiver = asyncio.create_task(self._run_archiver())
+
+    async def stop_archiver(self):
+        if self._archiver is not None:
+            self._archiver.cancel()
+            try:
+                await self._archiver
+            except asyncio.CancelledError:
+                pass
+            self._archiver = None
+
+    async def _run_archiver(self):
+        while True:
+            await asyncio.sleep(settings.SESSION_ARCHIVE_INTERVAL)
+            try:
+                r = await self._get_connection()
+                # One worker per interval does the pass
+                if await r.set(ARCHIVE_LOCK, "1", nx=True, ex=max(1, int(settings.SESSION_ARCHIVE_INTERVAL))):
+                    while await self.archive_idle_sessions() > 0:
+                        pass
+            except Exception as e:
+                logger.error("Session archive pass failed: %s", e)
+
+    def stats(self) -> dict:
+        return {"archived": self.archived, "rehydrated": self.rehydrated}
+
+    async def ensure_session_index(self):
+        """Backfill the session indexes from existing keys, once.
+
+        Uses SCAN rather than KEYS so the Redis server is never blocked. The
+        backfill is idempotent and only marked done once it has seen every key,
+        so an interrupted run is picked up again by the next start.
+        """
+        r = await self._get_connection()
+        if await r.exists(SESSIONS_BACKFILLED):
+            return
+        # A lock of its own: on a large deployment the scan outlasts the schema lock timeout
+        async with clients.schema_lock("lock:session_backfill", settings.MIGRATION_LOCK_TIMEOUT):
+            # Checked again under the lock: another worker may have just finished it
+            if await r.exists(SESSIONS_BACKFILLED):
+                return
+            await self._backfill_indexes(r)
+            await r.set(SESSIONS_BACKFILLED, int(time.time()))
+        logger.info("Backfilled the session indexes")
+
+    async def _backfill_indexes(self, r):
+        async for key in r.scan_iter(match="session_meta:*", count=1000):
+            data = await r.get(key)
+            if not data:
+                continue
+            meta = json.loads(data)
+            async with r.pipeline(transaction=True) as pipe:
+                pipe.zadd(SESSIONS_BY_CREATED, {meta["id"]: meta.get("created_at", 0)}, nx=True)
+                # Unknown activity: treat it as now so the session stays hot for a full idle period
+                pipe.zadd(SESSIONS_BY_ACTIVITY, {meta["id"]: time.time()}, nx=True)
+                await pipe.execute()
+        # Lists written before tiering may still carry an expiry; keep them for the archiver instead
+        async for key in r.scan_iter(match="session:*", count=1000, _type="list"):
+            session_id = key.removeprefix("session:")
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.persist(key)
+                pipe.zadd(SESSIONS_HOT, {session_id: time.time()}, nx=True)
+                await pipe.execute()
 
+    @timed(REDIS_SECONDS, "update_session_title")
     async def update_session_title(self, session_id: str, title: str):
         """Update the title of an existing session."""
         r = await self._get_connection()
@@ -81,7 +357,9 @@ class MemoryService:
         if data:
             meta = json.loads(data)
             meta["title"] = title
-            await r.set(key, json.dumps(meta))
-        await r.close()
+            async with r.pipeline(transaction=True) as pipe:
+                pipe.set(key, json.dumps(meta))
+                pipe.zadd(SESSIONS_BY_ACTIVITY, {session_id: time.time()}, xx=True)
+                await pipe.execute()
 
 memory_service = MemoryService()
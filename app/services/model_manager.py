@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from app.core.clients import clients
+from app.core.config import settings
+from app.core.metrics import MODEL_LOAD_SECONDS, MODEL_RESIDENT
+from app.services.scheduler import RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+def canonical(model: str) -> str:
+    """Model name as Ollama reports it, with the implicit `:latest` tag."""
+    return model if ":" in model else f"{model}:latest"
+
+class OllamaHost:
+    """One Ollama backend: its request scheduler and the models it has loaded."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.scheduler = RequestScheduler(settings.OLLAMA_MAX_CONCURRENCY, {
+            "chat": settings.OLLAMA_CHAT_QUEUE_SIZE,
+            "embedding": settings.OLLAMA_EMBEDDING_QUEUE_SIZE,
+            "background": settings.OLLAMA_BACKGROUND_QUEUE_SIZE,
+        })
+        self.resident: set[str] = set()
+        self.healthy = True
+
+    @property
+    def load(self) -> int:
+        """Requests running or waiting on this host."""
+        return self.scheduler.in_flight + sum(self.scheduler.depth.values())
+
+class ModelManager:
+    """Keeps the active model loaded and routes requests across Ollama hosts.
+
+    Models are loaded ahead of the first request (at startup and on every
+    switch) and every call sends the same `keep_alive` and `num_ctx`, so
+    Ollama neither unloads the model when idle nor reloads it for a context
+    size change. Which models each host holds is polled from /api/ps and
+    updated as requests succeed; requests go to the least loaded host that
+    already has the model, falling back to the least loaded healthy host.
+    """
+
+    def __init__(self):
+        urls = settings.OLLAMA_URLS or settings.OLLAMA_URL
+        self.hosts = [OllamaHost(url.strip()) for url in urls.split(",") if url.strip()]
+        self._poller: asyncio.Task | None = None
+        self.warmups = 0
+        self.failed_warmups = 0
+
+    def request_options(self) -> dict:
+        """Fields added to every chat and embedding request body."""
+        fields = {"keep_alive": settings.OLLAMA_KEEP_ALIVE}
+        if settings.OLLAMA_NUM_CTX:
+            fields["options"] = {"num_ctx": settings.OLLAMA_NUM_CTX}
+        return fields
+
+    def pick(self, model: str) -> OllamaHost:
+        """Host to send a request for `model` to."""
+        model = canonical(model)
+        candidates = [host for host in self.hosts if host.healthy] or self.hosts
+        return min(candidates, key=lambda host: (model not in host.resident, host.load))
+
+    def mark_resident(self, host: OllamaHost, model: str):
+        model = canonical(model)
+        if model not in host.resident:
+            host.resident.add(model)
+            MODEL_RESIDENT.labels(host.url, model).set(1)
+
+    async def start(self):
+        """Start polling /api/ps. Called from the application lifespan."""
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def _poll(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(settings.OLLAMA_PS_INTERVAL)
+
+    async def refresh(self):
+        """Reload the set of resident models from every host."""
+        await asyncio.gather(*(self._refresh_host(host) for host in self.hosts))
+
+    async def _refresh_host(self, host: OllamaHost):
+        try:
+            response = await clients.http.get(f"{host.url}/api/ps", timeout=5.0)
+            response.raise_for_status()
+            resident = {canonical(m.get("name") or m.get("model", "")) for m in response.json().get("models", [])}
+        except Exception as e:
+            if host.healthy:
+                logger.warning("Ollama host %s is unreachable: %s", host.url, e)
+            host.healthy = False
+            return
+        host.healthy = True
+        for model in host.resident - resident:
+            MODEL_RESIDENT.remove(host.url, model)
+        for model in resident - host.resident:
+            MODEL_RESIDENT.labels(host.url, model).set(1)
+        host.resident = resident
+
+    async def warm(self, model: str):
+        """Load `model` into memory on every host, without generating anything."""
+        await asyncio.gather(*(self._warm_host(host, model) for host in self.hosts))
+
+    async def _warm_host(self, host: OllamaHost, model: str):
+        started = time.perf_counter()
+        try:
+            # An empty prompt makes Ollama load the model and return immediately
+            response = await clients.http.post(
+                f"{host.url}/api/generate",
+                json={"model": model, "prompt": "", **self.request_options()},
+                timeout=None,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            self.failed_warmups += 1
+            logger.warning("Failed to warm up %s on %s: %s", model, host.url, e)
+            return
+        self.warmups += 1
+        MODEL_LOAD_SECONDS.labels("warmup").observe(time.perf_counter() - started)
+        self.mark_resident(host, model)
+        logger.info("Warmed up %s on %s in %.1fs", model, host.url, time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            "warmups": self.warmups,
+            "failed_warmups": self.failed_warmups,
+            "hosts": {
+                host.url: {
+                    "healthy": host.healthy,
+                    "resident": sorted(host.resident),
+                    "scheduler": host.scheduler.stats(),
+                }
+                for host in self.hosts
+            },
+        }
+
+model_manager = ModelManager()
@@ -0,0 +1,99 @@
+import hashlib
+import math
+import re
+import time
+from collections import OrderedDict
+from app.core.config import settings
+from app.core.metrics import RESPONSE_CACHE
+
+def fingerprint(*parts: str) -> str:
+    """Stable digest of everything besides the question that shapes an answer."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+async def replay(answer: str):
+    """Stream a stored answer back as word-sized tokens."""
+    for token in re.findall(r"\s*\S+\s*", answer) or [answer]:
+        yield token
+
+def _normalized(vector: list[float]) -> list[float] | None:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else None
+
+class ResponseCache:
+    """In-process cache of generated answers, looked up by question similarity.
+
+    Answers are grouped by (model, fingerprint), where the fingerprint covers
+    the retrieved context and the earlier conversation, so a hit is only
+    possible when the model would see the same prompt apart from the
+    question. Within a group, the stored answer whose question embedding is
+    closest to the new one is returned if it scores at least `threshold`.
+    Entries expire after `ttl` seconds; past `max_size` entries the least
+    recently used groups are evicted.
+    """
+
+    def __init__(self, max_size: int = settings.RESPONSE_CACHE_SIZE, ttl: int = settings.RESPONSE_CACHE_TTL, threshold: float = settings.RESPONSE_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        # (model, fingerprint) -> [(unit question vector, answer, expires_at)]
+        self._groups: OrderedDict[tuple[str, str], list[tuple[list[float], str, float]]] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, context: str, embedding: list[float]) -> str | None:
+        """Return a stored answer to a question similar to `embedding`, if any."""
+        key = (model, context)
+        query = _normalized(embedding) if embedding else None
+        entries = self._groups.get(key)
+        best, best_score = None, self.threshold
+        if entries and query is not None:
+            now = time.monotonic()
+            live = [entry for entry in entries if entry[2] > now]
+            self._size -= len(entries) - len(live)
+            entries[:] = live
+            for vector, answer, _ in live:
+                if len(vector) != len(query):
+                    continue
+                score = sum(a * b for a, b in zip(vector, query))
+                if score >= best_score:
+                    best, best_score = answer, score
+            self._groups.move_to_end(key)
+
+        if best is None:
+            self.misses += 1
+            RESPONSE_CACHE.labels("miss").inc()
+        else:
+            self.hits += 1
+            RESPONSE_CACHE.labels("hit").inc()
+        return best
+
+    def set(self, model: str, context: str, embedding: list[float], answer: str):
+        """Store the answer generated for the question with `embedding`."""
+        vector = _normalized(embedding) if embedding else None
+        if vector is None or not answer.strip():
+            return
+        key = (model, context)
+        self._groups.setdefault(key, []).append((vector, answer, time.monotonic() + self.ttl))
+        self._groups.move_to_end(key)
+        self._size += 1
+        while self._size > self.max_size and self._groups:
+            _, evicted = self._groups.popitem(last=False)
+            self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.RESPONSE_CACHE_ENABLED,
+            "size": self._size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+response_cache = ResponseCache()
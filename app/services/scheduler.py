@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from app.core.metrics import OLLAMA_IN_FLIGHT, OLLAMA_QUEUE_DEPTH, OLLAMA_QUEUE_WAIT_SECONDS, OLLAMA_REJECTED
+
+# Request classes, most urgent first
+PRIORITIES = {"chat": 0, "embedding": 1, "background": 2}
+
+class Overloaded(Exception):
+    """A request was turned away: its queue was full or its deadline passed while waiting."""
+
+class RequestScheduler:
+    """Admission control for one Ollama host.
+
+    At most `max_concurrency` requests run at once; a streaming chat holds
+    its slot until the stream ends. Everything else waits in a priority
+    queue, served chat first, then embeddings, then background work, and in
+    arrival order within a class. A freed slot is handed straight to the
+    next waiter. Each class has a bounded queue, and a request given a
+    deadline is dropped if it cannot start in time.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: dict[str, int]):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiting: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.depth = {name: 0 for name in PRIORITIES}
+        self.admitted = {name: 0 for name in PRIORITIES}
+        self.rejected = {name: 0 for name in PRIORITIES}
+        self.expired = {name: 0 for name in PRIORITIES}
+
+    @asynccontextmanager
+    async def slot(self, priority: str, deadline: float | None = None):
+        """Hold one of the host's slots for the duration of the block.
+
+        Raises Overloaded if the class queue is full, or if `deadline`
+        seconds pass before a slot frees up.
+        """
+        await self._acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: str, deadline: float | None):
+        started = time.perf_counter()
+        # A free slot implies nobody is waiting: released slots go to waiters first
+        if self.in_flight < self.max_concurrency:
+            self.in_flight += 1
+            OLLAMA_IN_FLIGHT.inc()
+            self._admit(priority, started)
+            return
+        if self.depth[priority] >= self.max_queue[priority]:
+            self.rejected[priority] += 1
+            OLLAMA_REJECTED.labels(priority, "full").inc()
+            raise Overloaded(f"{priority} queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (PRIORITIES[priority], next(self._seq), future))
+        self.depth[priority] += 1
+        OLLAMA_QUEUE_DEPTH.labels(priority).inc()
+        try:
+            await asyncio.wait_for(future, deadline)
+        except asyncio.TimeoutError:
+            # As below: a slot handed over right at the deadline is passed on
+            if future.done() and not future.cancelled():
+                self._release()
+            self.expired[priority] += 1
+            OLLAMA_REJECTED.labels(priority, "expired").inc()
+            raise Overloaded(f"{priority} request waited more than {deadline}s") from None
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the caller went away
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            self.depth[priority] -= 1
+            OLLAMA_QUEUE_DEPTH.labels(priority).dec()
+        self._admit(priority, started)
+
+    def _admit(self, priority: str, started: float):
+        self.admitted[priority] += 1
+        OLLAMA_QUEUE_WAIT_SECONDS.labels(priority).observe(time.perf_counter() - started)
+
+    def _release(self):
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            # Waiters that timed out or were cancelled are skipped
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+        OLLAMA_IN_FLIGHT.dec()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queued": dict(self.depth),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "expired": dict(self.expired),
+        }
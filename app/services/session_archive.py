@@ -0,0 +1,89 @@
+import asyncio
+import os
+import struct
+import zlib
+from app.core.clients import clients
+from app.core.config import settings
+
+# Every segment starts with the index of its first message and its compressed length
+SEGMENT_HEADER = struct.Struct(">II")
+
+def encode_segment(start: int, messages: list[str]) -> bytes:
+    """Compress messages [start, start + len(messages)) of a session into one segment."""
+    # Messages are stored exactly as they sit in the Redis list; JSON never contains a raw newline
+    data = zlib.compress("\n".join(messages).encode("utf-8"))
+    return SEGMENT_HEADER.pack(start, len(data)) + data
+
+def decode_segments(data: bytes) -> list[str]:
+    """Rebuild a session's archived messages from its concatenated segments."""
+    messages: list[str] = []
+    offset = 0
+    while offset + SEGMENT_HEADER.size <= len(data):
+        start, length = SEGMENT_HEADER.unpack_from(data, offset)
+        offset += SEGMENT_HEADER.size
+        chunk = data[offset:offset + length]
+        offset += length
+        if len(chunk) < length:
+            # A torn write at the tail; every complete segment before it is intact
+            break
+        batch = zlib.decompress(chunk).decode("utf-8").split("\n")
+        # An archive pass that lost its race is retried with the same start, so overwrite
+        messages[start:start + len(batch)] = batch
+    return messages
+
+class RedisSessionArchive:
+    """Cold tier kept in Redis as one compressed, append-only binary string per session."""
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session_archive:{session_id}"
+
+    async def append(self, session_id: str, start: int, messages: list[str]):
+        await clients.redis_bytes.append(self._key(session_id), encode_segment(start, messages))
+
+    async def load(self, session_id: str) -> list[str]:
+        data = await clients.redis_bytes.get(self._key(session_id))
+        return decode_segments(data) if data else []
+
+    async def delete(self, session_id: str):
+        await clients.redis_bytes.delete(self._key(session_id))
+
+class DiskSessionArchive:
+    """Cold tier on local disk: one file of compressed, append-only segments per session."""
+
+    def __init__(self, path: str = settings.SESSION_ARCHIVE_PATH):
+        self.path = path
+
+    def _file(self, session_id: str) -> str:
+        return os.path.join(self.path, f"{session_id}.seg")
+
+    def _append(self, session_id: str, segment: bytes):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(session_id), "ab") as f:
+            f.write(segment)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load(self, session_id: str) -> list[str]:
+        try:
+            with open(self._file(session_id), "rb") as f:
+                return decode_segments(f.read())
+        except FileNotFoundError:
+            return []
+
+    def _delete(self, session_id: str):
+        try:
+            os.remove(self._file(session_id))
+        except FileNotFoundError:
+            pass
+
+    async def append(self, session_id: str, start: int, messages: list[str]):
+        await asyncio.to_thread(self._append, session_id, encode_segment(start, messages))
+
+    async def load(self, session_id: str) -> list[str]:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+session_archive = DiskSessionArchive() if settings.SESSION_ARCHIVE == "disk" else RedisSessionArchive()
@@ -1,71 +1,378 @@
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
+from app.core.clients import clients
 from app.core.config import settings
-import uuid
+from app.core.metrics import VECTOR_SECONDS, timed
+from app.services.facts import collection_name, fact_hash, fact_id, fact_owners, merge_owners
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# The single collection used before there was one per model; adopted by the first model of the same dimension
+LEGACY_COLLECTION = "knowledge_base"
+
+# Payload fields filtered on at search time, with their index types
+PAYLOAD_INDEXES = {
+    "sessions": models.PayloadSchemaType.KEYWORD,
+    "users": models.PayloadSchemaType.KEYWORD,
+    "source": models.PayloadSchemaType.KEYWORD,
+    "last_seen": models.PayloadSchemaType.INTEGER,
+}
+
+def scope_filter(session_id: str | None = None, user_id: str | None = None, since: int | None = None, include_shared: bool = True) -> models.Filter | None:
+    """Qdrant filter for facts owned by the session and/or user, last seen after `since`.
+
+    With neither owner given the scope is global. Otherwise facts owned by
+    nobody (shared knowledge) are included unless `include_shared` is False.
+    """
+    must = []
+    owned = []
+    if session_id:
+        owned.append(models.FieldCondition(key="sessions", match=models.MatchValue(value=session_id)))
+    if user_id:
+        owned.append(models.FieldCondition(key="users", match=models.MatchValue(value=user_id)))
+    if owned and include_shared:
+        shared = models.Filter(must=[
+            models.IsEmptyCondition(is_empty=models.PayloadField(key="sessions")),
+            models.IsEmptyCondition(is_empty=models.PayloadField(key="users")),
+        ])
+        must.append(models.Filter(should=[models.Filter(must=owned), shared]))
+    else:
+        must.extend(owned)
+    if since is not None:
+        must.append(models.FieldCondition(key="last_seen", range=models.Range(gte=since)))
+    return models.Filter(must=must) if must else None
 
 class VectorService:
     def __init__(self):
-        self.client = QdrantClient(url=settings.QDRANT_URL)
-        self.collection_name = "knowledge_base"
-        # Gemma 2B = 2048, Llama 3 = 4096. We default to 2048 now.
-        self._ensure_collection(dimension=2048)
-
-    def _ensure_collection(self, dimension: int = 2048):
-        collections = self.client.get_collections()
-        exists = any(c.name == self.collection_name for c in collections.collections)
-        
-        if exists:
-            # Check if dimension matches
-            info = self.client.get_collection(self.collection_name)
-            print(f"DEBUG: Qdrant Collection Info: {info}")
-            try:
-                # Handle both object and dict access for compatibility
-                current_dim = None
-                if hasattr(info.config.params.vectors, 'size'):
-                    current_dim = info.config.params.vectors.size
-                elif isinstance(info.config.params.vectors, dict):
-                    current_dim = info.config.params.vectors.get('size')
-                
-                print(f"DEBUG: Detected dimension: {current_dim}")
-
-                if current_dim != dimension:
-                    print(f"Dimension mismatch (Expected {dimension}, Found {current_dim}). Recreating collection...")
-                    self.client.delete_collection(self.collection_name)
-                    exists = False
-            except Exception as e:
-                print(f"DEBUG: Error checking dimensions: {e}")
-                # Fallback: Recreate if we can't verify
-                self.client.delete_collection(self.collection_name)
-                exists = False
-        
-        if not exists:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE),
+        self._client: AsyncQdrantClient | None = None
+        self.collection_name = settings.QDRANT_COLLECTION_PREFIX
+        # Collections known to exist, and the embedding dimension seen per model
+        self._ready: set[str] = set()
+        self.dimensions: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._legacy_gone = False
+
+    @property
+    def client(self) -> AsyncQdrantClient:
+        """Qdrant client, created on first use so importing this module does no I/O."""
+        if self._client is None:
+            # QDRANT_URL may also be ":memory:" or a local path for Qdrant's embedded mode
+            self._client = AsyncQdrantClient(
+                location=settings.QDRANT_URL,
+                prefer_grpc=settings.QDRANT_PREFER_GRPC,
+                grpc_port=settings.QDRANT_GRPC_PORT,
+                timeout=settings.QDRANT_TIMEOUT,
+            )
+        return self._client
+
+    async def setup(self):
+        """Check Qdrant and load the existing collections. Called from the application lifespan.
+
+        Collections are created lazily, one per embedding model and dimension,
+        the first time a vector from that model is stored.
+        """
+        collections = await self.client.get_collections()
+        names = [c.name for c in collections.collections if c.name.startswith(f"{self.collection_name}_")]
+        pending = [name for name in names if name not in self._ready]
+        if pending:
+            # Collections created before scoped retrieval get their payload indexes here
+            async with clients.schema_lock():
+                for name in pending:
+                    await self._ensure_indexes(name)
+        self._ready.update(names)
+
+    async def ping(self):
+        """Raise if Qdrant is unreachable. Used by the readiness check."""
+        await self.client.get_collections()
+
+    def collection_for(self, model: str, dimension: int) -> str:
+        return collection_name(self.collection_name, model, dimension)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def _quantization_config(self):
+        if settings.QDRANT_QUANTIZATION == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM,
+                )
+            )
+        if settings.QDRANT_QUANTIZATION == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM)
+            )
+        return None
+
+    def _search_params(self):
+        quantization = None
+        if settings.QDRANT_QUANTIZATION != "none":
+            quantization = models.QuantizationSearchParams(
+                rescore=settings.QDRANT_QUANTIZATION_RESCORE,
+                oversampling=settings.QDRANT_QUANTIZATION_OVERSAMPLING,
+            )
+        return models.SearchParams(hnsw_ef=settings.QDRANT_SEARCH_EF, quantization=quantization)
+
+    async def _ensure_indexes(self, name: str):
+        for field, schema in PAYLOAD_INDEXES.items():
+            await self.client.create_payload_index(collection_name=name, field_name=field, field_schema=schema)
+
+    async def _ensure_collection(self, model: str, dimension: int) -> str:
+        """Create the collection for this model and dimension if it is missing.
+
+        Existing collections are never dropped, so switching models keeps the
+        memory of every model intact.
+        """
+        name = self.collection_for(model, dimension)
+        if name in self._ready:
+            return name
+        async with self._lock:
+            if name in self._ready:
+                return name
+            if not await self.client.collection_exists(name):
+                async with clients.schema_lock():
+                    await self._create_collection(name, dimension)
+            self._ready.add(name)
+            self.dimensions[model] = dimension
+        return name
+
+    async def _create_collection(self, name: str, dimension: int):
+        # Another worker may have created it while this one waited for the lock
+        if not await self.client.collection_exists(name):
+            await self.client.create_collection(
+                collection_name=name,
+                vectors_config=models.VectorParams(
+                    size=dimension,
+                    distance=models.Distance.COSINE,
+                    on_disk=settings.QDRANT_ON_DISK_VECTORS,
+                ),
+                hnsw_config=models.HnswConfigDiff(
+                    m=settings.QDRANT_HNSW_M,
+                    ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+                ),
+                quantization_config=self._quantization_config(),
             )
-            print(f"Created Qdrant collection: {self.collection_name} with dim {dimension}")
+            await self._ensure_indexes(name)
+            logger.info("Created Qdrant collection: %s with dim %s", name, dimension)
 
-    def upsert_fact(self, text: str, embedding: list[float]):
+    async def _legacy_size(self) -> int | None:
+        """Vector size of LEGACY_COLLECTION, or None once it is gone."""
+        if self._legacy_gone:
+            return None
+        if not await self.client.collection_exists(LEGACY_COLLECTION):
+            self._legacy_gone = True
+            return None
+        info = await self.client.get_collection(LEGACY_COLLECTION)
+        return info.config.params.vectors.size
+
+    async def adopt_legacy(self, model: str, dimension: int):
+        """Move the facts of LEGACY_COLLECTION into the collection of `model`, as shared facts.
+
+        Run once in the background at startup with the active model; nothing
+        is moved unless its embeddings have the dimension of the old
+        collection. The copy is idempotent (point ids come from the text), so
+        a migration cut short is simply redone by the next start.
+        """
+        if await self._legacy_size() != dimension:
+            return
+        name = await self._ensure_collection(model, dimension)
+        async with clients.schema_lock("lock:legacy_facts", settings.MIGRATION_LOCK_TIMEOUT):
+            # Another worker may have moved them while this one waited for the lock
+            if await self._legacy_size() == dimension:
+                await self._move_legacy(name)
+
+    async def _move_legacy(self, name: str):
+        now = int(time.time())
+        copied = 0
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(
+                collection_name=LEGACY_COLLECTION, limit=256, offset=offset, with_payload=True, with_vectors=True
+            )
+            batch = {}
+            for point in points:
+                text = (point.payload or {}).get("text")
+                if text:
+                    digest = fact_hash(text)
+                    batch[digest] = models.PointStruct(
+                        id=fact_id(digest),
+                        vector=point.vector,
+                        payload={
+                            "text": text, "hash": digest, "hits": 1, "sessions": [], "users": [],
+                            "source": "chat", "first_seen": now, "last_seen": now,
+                        },
+                    )
+            if batch:
+                await self.client.upsert(collection_name=name, points=list(batch.values()))
+                copied += len(batch)
+            if offset is None:
+                break
+        await self.client.delete_collection(LEGACY_COLLECTION)
+        self._legacy_gone = True
+        logger.info("Moved %s facts from %s into %s", copied, LEGACY_COLLECTION, name)
+
+    async def _existing_collection(self, model: str, dimension: int) -> str | None:
+        """Collection for reads: None if nothing was ever stored for this model."""
+        name = self.collection_for(model, dimension)
+        if name not in self._ready and await self.client.collection_exists(name):
+            self._ready.add(name)
+        return name if name in self._ready else None
+
+    def collections(self) -> list[str]:
+        """All knowledge collections this worker knows about."""
+        return sorted(self._ready)
+
+    async def upsert_fact(self, text: str, embedding: list[float], model: str, meta: dict | None = None):
         """Save a fact with its vector embedding."""
-        point_id = str(uuid.uuid4())
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                models.PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload={"text": text}
+        await self.upsert_facts([(text, embedding, meta or {})], model)
+
+    @timed(VECTOR_SECONDS, "upsert")
+    async def upsert_facts(self, facts: list[tuple[str, list[float], dict]], model: str):
+        """Save several facts embedded by `model`, folding duplicates into the points that already hold them.
+
+        Each fact carries a `meta` dict with optional session_id, user_id and
+        source. A fact whose content hash is already stored, or whose nearest
+        point in the same scope scores at least FACT_DEDUP_THRESHOLD, bumps
+        that point's hit count, last_seen time and owners instead of adding a
+        new point.
+        """
+        if not facts:
+            return
+        collection = await self._ensure_collection(model, len(facts[0][1]))
+        now = int(time.time())
+
+        # Collapse exact duplicates inside the batch first
+        batch: dict[str, dict] = {}
+        for text, embedding, meta in facts:
+            digest = fact_hash(text)
+            if digest in batch:
+                batch[digest]["hits"] += 1
+                batch[digest].update(merge_owners(batch[digest], fact_owners(meta)))
+            else:
+                batch[digest] = {"text": text, "vector": embedding, "hits": 1, "source": meta.get("source", "chat"), **fact_owners(meta)}
+
+        bumps: dict[str, dict] = {}
+        def bump(point, entry: dict):
+            point_id = str(point.id)
+            current = bumps.get(point_id)
+            if current is None:
+                payload = point.payload or {}
+                current = {"hits": payload.get("hits", 1), "sessions": payload.get("sessions", []), "users": payload.get("users", [])}
+            bumps[point_id] = {"hits": current["hits"] + entry["hits"], "last_seen": now, **merge_owners(current, entry)}
+
+        new = dict(batch)
+        if settings.FACT_DEDUP_ENABLED:
+            digests = {fact_id(digest): digest for digest in batch}
+            existing = await self.client.retrieve(
+                collection_name=collection,
+                ids=list(digests),
+                with_payload=["hits", "sessions", "users"],
+            )
+            for point in existing:
+                bump(point, new.pop(digests[str(point.id)]))
+
+            if new:
+                # Nearest neighbour of every remaining fact within its own scope, in one request
+                responses = await self.client.query_batch_points(
+                    collection_name=collection,
+                    requests=[
+                        models.QueryRequest(
+                            query=entry["vector"],
+                            filter=self._owner_filter(entry),
+                            limit=1,
+                            score_threshold=settings.FACT_DEDUP_THRESHOLD,
+                            with_payload=["hits", "sessions", "users"],
+                        )
+                        for entry in new.values()
+                    ],
                 )
-            ]
-        )
+                for digest, response in list(zip(new, responses)):
+                    if response.points:
+                        bump(response.points[0], new.pop(digest))
 
-    def search_relevant(self, query_vector: list[float], limit: int = 3):
-        """Find facts similar to the query vector."""
-        results = self.client.query_points(
-            collection_name=self.collection_name,
+        if new:
+            await self.client.upsert(
+                collection_name=collection,
+                points=[
+                    models.PointStruct(
+                        id=fact_id(digest),
+                        vector=entry["vector"],
+                        payload={
+                            "text": entry["text"],
+                            "hash": digest,
+                            "hits": entry["hits"],
+                            "sessions": entry["sessions"],
+                            "users": entry["users"],
+                            "source": entry["source"],
+                            "first_seen": now,
+                            "last_seen": now,
+                        }
+                    )
+                    for digest, entry in new.items()
+                ]
+            )
+        if bumps:
+            await self.client.batch_update_points(
+                collection_name=collection,
+                update_operations=[
+                    models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload, points=[point_id]))
+                    for point_id, payload in bumps.items()
+                ],
+            )
+
+    @staticmethod
+    def _owner_filter(entry: dict) -> models.Filter:
+        """Points with exactly the same visibility as `entry`, so dedup never merges across scopes."""
+        if not (entry["sessions"] or entry["users"]):
+            return models.Filter(must=[
+                models.IsEmptyCondition(is_empty=models.PayloadField(key="sessions")),
+                models.IsEmptyCondition(is_empty=models.PayloadField(key="users")),
+            ])
+        session_id = entry["sessions"][0] if entry["sessions"] else None
+        user_id = entry["users"][0] if entry["users"] else None
+        return scope_filter(session_id, user_id, include_shared=False)
+
+    @timed(VECTOR_SECONDS, "search")
+    async def search_relevant(
+        self,
+        query_vector: list[float],
+        model: str,
+        limit: int = 3,
+        session_id: str | None = None,
+        user_id: str | None = None,
+        since: int | None = None,
+        include_shared: bool = True,
+        score_threshold: float | None = None,
+    ):
+        """Find facts similar to the query vector, among those embedded by `model`.
+
+        Scope arguments are described in `scope_filter`; hits scoring below
+        `score_threshold` are dropped.
+        """
+        collection = await self._existing_collection(model, len(query_vector))
+        if collection is None:
+            return []
+        response = await self.client.query_points(
+            collection_name=collection,
             query=query_vector,
-            limit=limit
-        ).points
+            query_filter=scope_filter(session_id, user_id, since, include_shared),
+            limit=limit,
+            score_threshold=score_threshold,
+            search_params=self._search_params(),
+        )
+        results = response.points
         return [hit.payload["text"] for hit in results]
 
-vector_service = VectorService()
+def _create_vector_service():
+    if settings.VECTOR_BACKEND == "local":
+        from app.services.local_vectors import LocalVectorService
+        return LocalVectorService()
+    return VectorService()
+
+vector_service = _create_vector_service()
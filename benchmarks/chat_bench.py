@@ -0,0 +1,172 @@
+"""End-to-end benchmark of the chat pipeline against local stand-ins.
+
+Runs the real FastAPI app with Redis replaced by fakeredis, Qdrant in its
+in-memory mode and Ollama replaced by benchmarks.fake_ollama, then drives
+concurrent websocket sessions plus /knowledge traffic and reports
+time-to-first-token, turn latency percentiles, tokens/s and throughput for
+each concurrency level.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.chat_bench --concurrency 1,8,32 --turns 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated session counts to run")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per session")
+    parser.add_argument("--knowledge-ops", type=int, default=2, help="/knowledge add+search pairs per session")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per fake answer")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake tokens per second")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="fake prompt processing time (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="fake embedding time (s)")
+    parser.add_argument("--dimension", type=int, default=256, help="fake embedding dimension")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    return parser.parse_args()
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def serve_in_background(args, app_port: int, ollama_port: int) -> threading.Event:
+    """Run the app and the fake Ollama on their own event loop in a thread."""
+    import fakeredis
+    import uvicorn
+    from app.core.clients import clients
+    from app.main import app
+    from benchmarks.fake_ollama import create_app
+
+    fake_ollama = create_app(args.tokens, args.token_rate, args.first_token_latency, args.embed_latency, args.dimension)
+    ready = threading.Event()
+
+    async def main():
+        server = fakeredis.FakeServer()
+        clients.use(
+            redis=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            redis_bytes=fakeredis.FakeAsyncRedis(server=server),
+        )
+        servers = [
+            uvicorn.Server(uvicorn.Config(app, port=app_port, log_level="warning", ws_ping_interval=None)),
+            uvicorn.Server(uvicorn.Config(fake_ollama, port=ollama_port, log_level="warning")),
+        ]
+        tasks = [asyncio.create_task(s.serve()) for s in servers]
+        while not all(s.started for s in servers):
+            await asyncio.sleep(0.05)
+        ready.set()
+        await asyncio.gather(*tasks)
+
+    threading.Thread(target=asyncio.run, args=(main(),), daemon=True).start()
+    return ready
+
+async def run_session(base_url: str, ws_url: str, index: int, args, results: dict):
+    import httpx
+    import websockets
+    from benchmarks.fake_ollama import END_TOKEN
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+        session = (await http.post("/sessions", json={"title": f"bench {index}"})).json()
+        async with websockets.connect(f"{ws_url}/ws/chat/{session['id']}", max_size=None) as ws:
+            for turn in range(args.turns):
+                # A few repeated phrasings exercise the caches the way real traffic does
+                message = f"question {turn % 3} from session {index % 4}"
+                started = time.perf_counter()
+                await ws.send(message)
+                first = None
+                text = ""
+                while not text.endswith(END_TOKEN):
+                    frame = await ws.recv()
+                    # Empty frames carry no tokens (e.g. Ollama's final "done" chunk)
+                    if not frame:
+                        continue
+                    text += frame
+                    if first is None:
+                        first = time.perf_counter()
+                finished = time.perf_counter()
+                results["ttft"].append(first - started)
+                results["latency"].append(finished - started)
+                results["tokens"] += args.tokens
+                if finished > first:
+                    results["turn_tps"].append(args.tokens / (finished - first))
+
+        for op in range(args.knowledge_ops):
+            started = time.perf_counter()
+            await http.post("/knowledge/add", json={"text": f"fact {op} about session {index}"})
+            results["knowledge_add"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await http.post("/knowledge/search", json={"query": f"fact {op}"})
+            results["knowledge_search"].append(time.perf_counter() - started)
+
+async def run_level(base_url: str, ws_url: str, concurrency: int, args) -> dict:
+    results = {"ttft": [], "latency": [], "turn_tps": [], "knowledge_add": [], "knowledge_search": [], "tokens": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_session(base_url, ws_url, i, args, results) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    def ms(values, q):
+        return round(percentile(values, q) * 1000, 1)
+
+    return {
+        "concurrency": concurrency,
+        "turns": len(results["latency"]),
+        "wall_s": round(wall, 2),
+        "turns_per_s": round(len(results["latency"]) / wall, 2),
+        "tokens_per_s": round(results["tokens"] / wall, 1),
+        "turn_tokens_per_s_p50": round(percentile(results["turn_tps"], 50), 1),
+        "ttft_ms": {q: ms(results["ttft"], q) for q in (50, 95, 99)},
+        "latency_ms": {q: ms(results["latency"], q) for q in (50, 95, 99)},
+        "knowledge_add_ms": {q: ms(results["knowledge_add"], q) for q in (50, 95)},
+        "knowledge_search_ms": {q: ms(results["knowledge_search"], q) for q in (50, 95)},
+    }
+
+def print_table(rows: list[dict]):
+    header = f"{'conc':>5} {'turns':>6} {'turns/s':>8} {'tok/s':>8} {'ttft p50':>9} {'ttft p95':>9} {'ttft p99':>9} {'lat p50':>8} {'lat p95':>8} {'lat p99':>8} {'kn add p95':>11} {'kn srch p95':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['concurrency']:>5} {r['turns']:>6} {r['turns_per_s']:>8} {r['tokens_per_s']:>8} "
+            f"{r['ttft_ms'][50]:>9} {r['ttft_ms'][95]:>9} {r['ttft_ms'][99]:>9} "
+            f"{r['latency_ms'][50]:>8} {r['latency_ms'][95]:>8} {r['latency_ms'][99]:>8} "
+            f"{r['knowledge_add_ms'][95]:>11} {r['knowledge_search_ms'][95]:>12}"
+        )
+    print("(latencies in ms)")
+
+def main():
+    args = parse_args()
+    app_port, ollama_port = free_port(), free_port()
+    # Settings are read at import time, so point the app at the stand-ins first
+    os.environ["REDIS_URL"] = "redis://fakeredis:6379/0"
+    os.environ["QDRANT_URL"] = ":memory:"
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{ollama_port}"
+
+    ready = serve_in_background(args, app_port, ollama_port)
+    if not ready.wait(30):
+        raise SystemExit("servers did not start")
+
+    base_url = f"http://127.0.0.1:{app_port}"
+    ws_url = f"ws://127.0.0.1:{app_port}"
+    rows = []
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        rows.append(asyncio.run(run_level(base_url, ws_url, concurrency, args)))
+    print_table(rows)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
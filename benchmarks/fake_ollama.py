@@ -0,0 +1,82 @@
+"""A stand-in for the Ollama HTTP API with controllable latency.
+
+Serves the endpoints Local-Mind calls: /api/chat streams `tokens` tokens
+after `first_token_latency` seconds at `token_rate` tokens per second,
+finishing with END_TOKEN; /api/embeddings and /api/embed return
+deterministic unit vectors of `dimension` floats after `embed_latency`.
+"""
+import asyncio
+import hashlib
+import json
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Every streamed answer ends with this token, so clients know the turn is over.
+END_TOKEN = "[END]"
+
+def fake_embedding(text: str, dimension: int) -> list[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def create_app(tokens: int = 64, token_rate: float = 50.0, first_token_latency: float = 0.2, embed_latency: float = 0.01, dimension: int = 256) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    app.state.requests = {}
+
+    def count(path: str):
+        app.state.requests[path] = app.state.requests.get(path, 0) + 1
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        count("/api/chat")
+        body = await request.json()
+
+        async def stream():
+            await asyncio.sleep(first_token_latency)
+            for i in range(tokens):
+                content = END_TOKEN if i == tokens - 1 else f"tok{i} "
+                yield json.dumps({"model": body["model"], "message": {"role": "assistant", "content": content}, "done": False}) + "\n"
+                await asyncio.sleep(1 / token_rate)
+            yield json.dumps({"model": body["model"], "message": {"role": "assistant", "content": ""}, "done": True, "eval_count": tokens}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        count("/api/embeddings")
+        body = await request.json()
+        await asyncio.sleep(embed_latency)
+        return {"embedding": fake_embedding(body["prompt"], dimension)}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        count("/api/embed")
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embed_latency)
+        return {"model": body["model"], "embeddings": [fake_embedding(text, dimension) for text in inputs]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        count("/api/generate")
+        body = await request.json()
+        return {"model": body.get("model"), "response": "", "done": True}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "gemma:2b", "model": "gemma:2b", "size": 0}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": "gemma:2b", "model": "gemma:2b"}]}
+
+    @app.post("/api/pull")
+    async def pull():
+        return StreamingResponse(iter([json.dumps({"status": "success"}) + "\n"]), media_type="application/x-ndjson")
+
+    @app.delete("/api/delete")
+    async def delete():
+        return {}
+
+    return app
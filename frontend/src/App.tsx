@@ -25,9 +25,19 @@ function App() {
 
   const fetchSessions = async () => {
     try {
-      const res = await fetch('http://localhost:8000/sessions');
+      // The list is paged: follow X-Next-Cursor until the last page
+      const data: Session[] = [];
+      let cursor: string | null = null;
+      let res: Response;
+      do {
+        const params = new URLSearchParams({ limit: '200' });
+        if (cursor) params.set('cursor', cursor);
+        res = await fetch(`http://localhost:8000/sessions?${params}`);
+        if (!res.ok) break;
+        data.push(...await res.json());
+        cursor = res.headers.get('X-Next-Cursor');
+      } while (cursor);
       if (res.ok) {
-        const data = await res.json();
         setSessions(data);
         // If we have sessions but no current one selected, select the first (latest)
         if (data.length > 0 && !currentSessionId) {
@@ -67,7 +77,7 @@ function App() {
   };
 
   // Only init chat if we have a session ID
-  const { messages, status, sendMessage, isTyping } = useChat(currentSessionId || "temp");
+  const { messages, status, sendMessage, stopGeneration, isTyping, isGenerating } = useChat(currentSessionId || "temp");
   const bottomRef = useRef<HTMLDivElement>(null);
 
   // Auto-scroll to bottom
@@ -139,7 +149,7 @@ function App() {
 
         {/* Input Area */}
         <footer className="shrink-0 bg-gradient-to-t from-slate-950 to-transparent pt-4">
-          <InputArea onSend={sendMessage} disabled={status !== 'connected'} />
+          <InputArea onSend={sendMessage} onStop={stopGeneration} disabled={status !== 'connected'} generating={isGenerating} />
           <p className="text-center text-xs text-slate-600 pb-4">
             Local-Mind v1.0 • Private & Secure
           </p>
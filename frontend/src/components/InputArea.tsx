@@ -1,12 +1,14 @@
 import React, { useState } from 'react';
-import { Send } from 'lucide-react';
+import { Send, Square } from 'lucide-react';
 
 type Props = {
     onSend: (text: string) => void;
+    onStop?: () => void;
     disabled?: boolean;
+    generating?: boolean;
 };
 
-export const InputArea = ({ onSend, disabled }: Props) => {
+export const InputArea = ({ onSend, onStop, disabled, generating }: Props) => {
     const [input, setInput] = useState("");
 
     const handleSubmit = (e: React.FormEvent) => {
@@ -28,13 +30,25 @@ export const InputArea = ({ onSend, disabled }: Props) => {
                     placeholder={disabled ? "Connecting..." : "Message Local-Mind..."}
                     className="w-full bg-slate-800 text-slate-100 rounded-full py-4 pl-6 pr-14 outline-none border border-slate-700 focus:border-primary focus:ring-1 focus:ring-primary transition-all disabled:opacity-50"
                 />
-                <button
-                    type="submit"
-                    disabled={!input.trim() || disabled}
-                    className="absolute right-2 p-2 bg-primary text-white rounded-full hover:bg-blue-600 disabled:bg-slate-600 disabled:cursor-not-allowed transition-colors"
-                >
-                    <Send size={20} />
-                </button>
+                {generating && onStop ? (
+                    <button
+                        type="button"
+                        onClick={onStop}
+                        disabled={disabled}
+                        title="Stop generating"
+                        className="absolute right-2 p-2 bg-slate-600 text-white rounded-full hover:bg-slate-500 disabled:cursor-not-allowed transition-colors"
+                    >
+                        <Square size={20} />
+                    </button>
+                ) : (
+                    <button
+                        type="submit"
+                        disabled={!input.trim() || disabled}
+                        className="absolute right-2 p-2 bg-primary text-white rounded-full hover:bg-blue-600 disabled:bg-slate-600 disabled:cursor-not-allowed transition-colors"
+                    >
+                        <Send size={20} />
+                    </button>
+                )}
             </div>
         </form>
     );
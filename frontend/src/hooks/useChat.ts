@@ -9,6 +9,8 @@ export const useChat = (sessionId: string) => {
     const [messages, setMessages] = useState<Message[]>([]);
     const [status, setStatus] = useState<'connecting' | 'connected' | 'disconnected'>('connecting');
     const [isTyping, setIsTyping] = useState(false);
+    // True from sending a message until its answer ends or is stopped
+    const [isGenerating, setIsGenerating] = useState(false);
     const wsRef = useRef<WebSocket | null>(null);
 
     useEffect(() => {
@@ -33,15 +35,22 @@ export const useChat = (sessionId: string) => {
         ws.onclose = () => {
             setStatus('disconnected');
             setIsTyping(false);
+            setIsGenerating(false);
         }
         ws.onerror = () => {
             setStatus('disconnected');
             setIsTyping(false);
+            setIsGenerating(false);
         }
 
         ws.onmessage = (event) => {
             const token = event.data;
             setIsTyping(false); // Received data, so stop typing
+            if (token === '') {
+                // An empty frame marks the end of the answer
+                setIsGenerating(false);
+                return;
+            }
             setMessages((prev) => {
                 const lastMsg = prev[prev.length - 1];
                 // If the last message is from assistant, append to it
@@ -69,9 +78,19 @@ export const useChat = (sessionId: string) => {
             // Optimistic update
             setMessages((prev) => [...prev, { role: 'user', content: text }]);
             setIsTyping(true); // Start typing indicator
+            setIsGenerating(true);
             wsRef.current.send(text);
         }
     };
 
-    return { messages, status, sendMessage, isTyping };
+    const stopGeneration = () => {
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            // The server stops the answer and keeps what was generated so far
+            wsRef.current.send(JSON.stringify({ type: 'stop' }));
+            setIsTyping(false);
+            setIsGenerating(false);
+        }
+    };
+
+    return { messages, status, sendMessage, stopGeneration, isTyping, isGenerating };
 };